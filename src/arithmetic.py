@@ -0,0 +1,179 @@
+import math
+import os
+import random
+import time
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+
+# Big-integer backend used by rsa.py and the engines. Call these through the module
+# (arithmetic.invert(...)) so that set_backend() takes effect everywhere.
+# Only key-level arithmetic (modular inverses, primality tests, modular exponentiation,
+# gcd) goes through the backend. The per-node checks of the engines work on bit lists and
+# truncated values of at most bit_length bits, and stay on plain int.
+
+
+def python_invert(a, m):
+    """
+    Compute the modular inverse of a modulo m with the built-in pow.
+
+    :param a: the number to compute the inverse of
+    :param m: the modulus
+    :return: the modular inverse of a modulo m, or None if a is not invertible
+    """
+    try:
+        return pow(a, -1, m)
+    except ValueError:
+        return None
+
+
+def python_is_prime(n, k=128):
+    """
+    Test if an integer n is a prime number using Miller-Rabin primality test with k rounds.
+
+    :param n: the number to test for primality
+    :param k: the number of tests to perform
+    :return: True if n is prime, False otherwise
+    """
+    if n == 2 or n == 3:
+        return True
+    if n <= 1 or n % 2 == 0:
+        return False
+
+    r, s = 0, n - 1
+    while s % 2 == 0:
+        r += 1
+        s //= 2
+
+    for _ in range(k):
+        a = random.randrange(2, n - 1)
+        x = pow(a, s, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(r - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def gmpy2_invert(a, m):
+    """
+    Compute the modular inverse of a modulo m with gmpy2.
+
+    :param a: the number to compute the inverse of
+    :param m: the modulus
+    :return: the modular inverse of a modulo m, or None if a is not invertible
+    """
+    if m == 1:
+        return 0
+    try:
+        return int(gmpy2.invert(a, m))
+    except ZeroDivisionError:
+        return None
+
+
+def gmpy2_is_prime(n, k=128):
+    """
+    Test if an integer n is a prime number with gmpy2 (Miller-Rabin with k rounds after trial division).
+    """
+    return bool(gmpy2.is_prime(n, k))
+
+
+def gmpy2_powmod(base, exponent, modulus):
+    """
+    Compute base^exponent mod modulus with gmpy2.
+    """
+    return int(gmpy2.powmod(base, exponent, modulus))
+
+
+def gmpy2_gcd(a, b):
+    """
+    Compute the greatest common divisor with gmpy2.
+    """
+    return int(gmpy2.gcd(a, b))
+
+
+BACKENDS = {
+    "python": {
+        "invert": python_invert,
+        "is_prime": python_is_prime,
+        "powmod": pow,
+        "gcd": math.gcd,
+    },
+}
+if gmpy2 is not None:
+    BACKENDS["gmpy2"] = {
+        "invert": gmpy2_invert,
+        "is_prime": gmpy2_is_prime,
+        "powmod": gmpy2_powmod,
+        "gcd": gmpy2_gcd,
+    }
+
+
+def set_backend(name):
+    """
+    Select the big-integer backend used by the module level functions.
+
+    :param name: "python" or "gmpy2"
+    """
+    global BACKEND, invert, is_prime, powmod, gcd
+    if name not in BACKENDS:
+        raise ValueError(f"unknown or unavailable arithmetic backend: {name}")
+    BACKEND = name
+    functions = BACKENDS[name]
+    invert = functions["invert"]
+    is_prime = functions["is_prime"]
+    powmod = functions["powmod"]
+    gcd = functions["gcd"]
+
+
+# gmpy2 when it is installed, unless RSA_ARITH_BACKEND says otherwise
+set_backend(os.environ.get("RSA_ARITH_BACKEND", "gmpy2" if gmpy2 is not None else "python"))
+
+
+def benchmark(sizes=(512, 1024, 2048, 4096), repeats=200):
+    """
+    Time invert, powmod and is_prime of every available backend on random operands.
+
+    :param sizes: Bit sizes of the operands
+    :param repeats: Number of calls timed per operation (is_prime uses repeats // 20)
+    :return: Dictionary mapping (backend, operation, size) to seconds per call
+    """
+    results = {}
+    for size in sizes:
+        modulus = random.getrandbits(size) | (1 << (size - 1)) | 1
+        operands = [random.getrandbits(size) % modulus for _ in range(repeats)]
+        exponent = random.getrandbits(size)
+        candidate = random.getrandbits(size) | (1 << (size - 1)) | 1
+        while not python_is_prime(candidate, 8):
+            candidate += 2
+
+        for name, functions in BACKENDS.items():
+            start_time = time.perf_counter()
+            for a in operands:
+                functions["invert"](a, modulus)
+            results[(name, "invert", size)] = (time.perf_counter() - start_time) / repeats
+
+            start_time = time.perf_counter()
+            for a in operands[:max(1, repeats // 10)]:
+                functions["powmod"](a, exponent, modulus)
+            results[(name, "powmod", size)] = (time.perf_counter() - start_time) / max(1, repeats // 10)
+
+            start_time = time.perf_counter()
+            for _ in range(max(1, repeats // 20)):
+                functions["is_prime"](candidate, 25)
+            results[(name, "is_prime", size)] = (time.perf_counter() - start_time) / max(1, repeats // 20)
+    return results
+
+
+if __name__ == "__main__":
+    results = benchmark()
+    print(f"{'backend':<8} {'operation':<9} {'bits':>5} {'microseconds':>14}")
+    for (name, operation, size), seconds in sorted(results.items(), key=lambda item: (item[0][1], item[0][2], item[0][0])):
+        print(f"{name:<8} {operation:<9} {size:>5} {seconds * 1e6:>14.2f}")
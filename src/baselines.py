@@ -0,0 +1,297 @@
+import bisect
+import math
+import statistics
+import time
+import arithmetic
+from helpers import *
+
+
+# Iterations between two looks at the clock and two gcds in the budgeted loops
+CHECK_INTERVAL = 128
+
+DEFAULT_PRIME_LIMIT = 1 << 20
+DEFAULT_MAX_SECONDS = 10.0
+
+_PRIME_TABLE = []
+_PRIME_TABLE_LIMIT = 0
+
+
+class Budget:
+    """
+    Iteration and time budget of a baseline. A None limit means no limit.
+    """
+
+    def __init__(self, max_iterations=None, max_seconds=None):
+        self.max_iterations = max_iterations
+        self.max_seconds = max_seconds
+        self.start_time = time.perf_counter()
+        self.iterations = 0
+
+    def spend(self, iterations=1):
+        """
+        Count iterations and check the budget.
+
+        :param iterations: Number of iterations done since the last call
+        :return: False once the budget is exhausted
+        """
+        self.iterations += iterations
+        if self.max_iterations is not None and self.iterations >= self.max_iterations:
+            return False
+        if self.max_seconds is not None and time.perf_counter() - self.start_time >= self.max_seconds:
+            return False
+        return True
+
+
+def prime_table(limit=DEFAULT_PRIME_LIMIT):
+    """
+    Primes below limit, from a sieve of Eratosthenes that is only recomputed for a larger limit.
+
+    :param limit: Exclusive upper bound
+    :return: List of primes
+    """
+    global _PRIME_TABLE, _PRIME_TABLE_LIMIT
+    if limit > _PRIME_TABLE_LIMIT:
+        sieve = bytearray([1]) * limit
+        sieve[0:2] = b"\x00\x00"
+        for i in range(2, math.isqrt(limit - 1) + 1):
+            if sieve[i]:
+                sieve[i * i::i] = bytes(len(range(i * i, limit, i)))
+        _PRIME_TABLE = [i for i in range(limit) if sieve[i]]
+        _PRIME_TABLE_LIMIT = limit
+    return _PRIME_TABLE[:bisect.bisect_left(_PRIME_TABLE, limit)]
+
+
+def split(N, factor):
+    """
+    Return the factor pair (p, q) with p <= q, or None if factor is trivial.
+    """
+    if factor in (1, N) or N % factor:
+        return None
+    return min(factor, N // factor), max(factor, N // factor)
+
+
+def trial_division(N, budget=None, limit=DEFAULT_PRIME_LIMIT):
+    """
+    Divide N by the primes of the prime table below limit.
+
+    :param N: The number to factorize
+    :param budget: Optional Budget, one iteration per prime
+    :param limit: Largest trial divisor
+    :return: Tuple (p, q) if a factor is found, None otherwise
+    """
+    budget = budget or Budget()
+    for i, prime in enumerate(prime_table(limit)):
+        if prime * prime > N:
+            return None
+        if N % prime == 0:
+            return split(N, prime)
+        if i % CHECK_INTERVAL == CHECK_INTERVAL - 1 and not budget.spend(CHECK_INTERVAL):
+            return None
+    return None
+
+
+def fermat(N, budget=None):
+    """
+    Fermat's method with exact integer square roots: look for a with a^2 - N a square.
+
+    Unlike math.ceil(math.sqrt(N)), math.isqrt is exact beyond the float range.
+
+    :param N: The number to factorize (odd)
+    :param budget: Optional Budget, one iteration per candidate a
+    :return: Tuple (p, q) if found, None otherwise
+    """
+    if N % 2 == 0:
+        return split(N, 2)
+    budget = budget or Budget()
+    a = math.isqrt(N)
+    if a * a < N:
+        a += 1
+    b2 = a * a - N
+    iterations = 0
+    while True:
+        b = math.isqrt(b2)
+        if b * b == b2:
+            return split(N, a - b)
+        # (a + 1)^2 - N = a^2 - N + 2a + 1
+        b2 += 2 * a + 1
+        a += 1
+        iterations += 1
+        if iterations == CHECK_INTERVAL:
+            if not budget.spend(iterations):
+                return None
+            iterations = 0
+
+
+def pollard_rho_brent(N, budget=None, seed=1):
+    """
+    Pollard's rho with Brent's cycle detection, accumulating CHECK_INTERVAL differences
+    per gcd. The polynomial x^2 + c is changed when the walk collapses to N.
+
+    :param N: The number to factorize
+    :param budget: Optional Budget, one iteration per step of the walk
+    :param seed: First value of c
+    :return: Tuple (p, q) if found, None otherwise
+    """
+    if N % 2 == 0:
+        return split(N, 2)
+    budget = budget or Budget()
+    for c in range(seed, seed + 64):
+        y, r, q, g = 2, 1, 1, 1
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y * y + c) % N
+            k = 0
+            while k < r and g == 1:
+                saved_y = y
+                steps = min(CHECK_INTERVAL, r - k)
+                for _ in range(steps):
+                    y = (y * y + c) % N
+                    q = q * abs(x - y) % N
+                g = arithmetic.gcd(q, N)
+                k += steps
+                if g == 1 and not budget.spend(steps):
+                    return None
+            r *= 2
+        if g == N:
+            # Replay the last batch one step at a time
+            g = 1
+            while g == 1:
+                saved_y = (saved_y * saved_y + c) % N
+                g = arithmetic.gcd(abs(x - saved_y), N)
+        if g != N:
+            return split(N, g)
+    return None
+
+
+def pollard_p_minus_1(N, budget=None, bound=DEFAULT_PRIME_LIMIT):
+    """
+    Pollard's p - 1 (stage 1): raise 2 to every prime power below bound, which finds p
+    when p - 1 is bound-smooth.
+
+    :param N: The number to factorize
+    :param budget: Optional Budget, one iteration per prime
+    :param bound: Smoothness bound
+    :return: Tuple (p, q) if found, None otherwise
+    """
+    if N % 2 == 0:
+        return split(N, 2)
+    budget = budget or Budget()
+    a = 2
+    primes = prime_table(bound + 1)
+    for i, prime in enumerate(primes):
+        power = prime
+        while power * prime <= bound:
+            power *= prime
+        a = arithmetic.powmod(a, power, N)
+        if i % CHECK_INTERVAL == CHECK_INTERVAL - 1 or i == len(primes) - 1:
+            g = arithmetic.gcd(a - 1, N)
+            if g == N:
+                return None
+            if g > 1:
+                return split(N, g)
+            if not budget.spend(CHECK_INTERVAL):
+                return None
+    return None
+
+
+BASELINES = {
+    "trial_division": trial_division,
+    "fermat": fermat,
+    "pollard_rho": pollard_rho_brent,
+    "pollard_p_minus_1": pollard_p_minus_1,
+}
+
+
+def run_baseline(name, N, max_iterations=None, max_seconds=DEFAULT_MAX_SECONDS):
+    """
+    Run a baseline on N under a budget and measure it like the engines in performance_test.
+
+    :param name: Name of the baseline, one of BASELINES
+    :param N: The number to factorize
+    :param max_iterations: Iteration budget
+    :param max_seconds: Time budget
+    :return: Tuple (time taken, result)
+    """
+    start_time = time.time()
+    result = BASELINES[name](N, Budget(max_iterations, max_seconds))
+    return time.time() - start_time, result
+
+
+def compare_with_engines(bitsizes, revealrate, trials=3, engine="branch_prune", e=17, baselines=None,
+                         max_seconds=DEFAULT_MAX_SECONDS):
+    """
+    Time a leak-based engine and the baselines on the same keys at every bitsize.
+
+    :param bitsizes: Bit sizes of p and q
+    :param revealrate: The rate at which bits are revealed to the engine (0 to 1)
+    :param trials: Keys per bitsize
+    :param engine: "branch_prune" or "crt_pruning"
+    :param e: The public exponent for crt_pruning
+    :param baselines: Names of the baselines (default: all)
+    :param max_seconds: Time budget of a baseline run
+    :return: List of rows (bitsize, method, successes, median seconds, speedup of the engine),
+             the speedup being None for the engine itself and a lower bound when the baseline
+             ran out of budget
+    """
+    from branch_prune import branch_and_prune
+    from crt_pruning import branch_and_prune_crt
+
+    baselines = baselines or list(BASELINES)
+    rows = []
+    for bitsize in bitsizes:
+        times = {name: [] for name in [engine] + baselines}
+        successes = {name: 0 for name in times}
+        for _ in range(trials):
+            if engine == "branch_prune":
+                N, p, q, p_bits, q_bits, p_erased, q_erased = example_generator(revealrate, bitsize)
+                start_time = time.time()
+                result = branch_and_prune(N, p_erased, q_erased)
+            else:
+                N, dp_bits, dq_bits, dp, dq, dp_erased, dq_erased, p, q = example_generator_crt_pruning(
+                    revealrate, bitsize, e)
+                start_time = time.time()
+                result = branch_and_prune_crt(N, e, dp_erased, dq_erased)
+            times[engine].append(time.time() - start_time)
+            successes[engine] += result is not None
+            for name in baselines:
+                elapsed_time, result = run_baseline(name, N, max_seconds=max_seconds)
+                times[name].append(elapsed_time)
+                successes[name] += result is not None
+
+        engine_time = statistics.median(times[engine])
+        for name in [engine] + baselines:
+            median_time = statistics.median(times[name])
+            speedup = None if name == engine or not engine_time else median_time / engine_time
+            rows.append((bitsize, name, successes[name], median_time, speedup))
+    return rows
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare a leak-based engine with classical factoring methods')
+    parser.add_argument('--bitsizes', nargs='+', type=int, default=[16, 24, 32, 48, 64, 128],
+                        help='Bit sizes of p and q')
+    parser.add_argument('--revealrate', type=float, default=0.6, help='Bit reveal rate given to the engine')
+    parser.add_argument('--trials', type=int, default=3, help='Keys per bitsize')
+    parser.add_argument('--engine', choices=['branch_prune', 'crt_pruning'], default='branch_prune')
+    parser.add_argument('--e', type=int, default=17, help='Public exponent for crt_pruning')
+    parser.add_argument('--baselines', nargs='+', choices=list(BASELINES), default=None)
+    parser.add_argument('--max-seconds', type=float, default=DEFAULT_MAX_SECONDS, help='Time budget of a baseline run')
+    args = parser.parse_args()
+
+    rows = compare_with_engines(args.bitsizes, args.revealrate, args.trials, args.engine, args.e,
+                                args.baselines, args.max_seconds)
+    print(f"{'bits':>5} {'method':<18} {'found':>6} {'median s':>10} {'engine speedup':>15}")
+    for bitsize, name, found, median_time, speedup in rows:
+        if speedup is None:
+            speedup_text = "-"
+        else:
+            # A baseline that gave up on some keys only gives a lower bound on its time
+            speedup_text = ("" if found == args.trials else ">") + f"{speedup:.1f}x"
+        print(f"{bitsize:>5} {name:<18} {found:>3}/{args.trials:<2} {median_time:>10.4f} {speedup_text:>15}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+import time
+import numpy as np
+from helpers import *
+
+
+# Every congruence is checked mod 2^(i+1) with i < 64, so uint64 wrap-around arithmetic is exact
+MAX_BATCH_BITS = 64
+
+
+def pack_known_bits(known_bits_list, bit_length):
+    """
+    Pack the known bits of many instances into two uint64 arrays.
+
+    :param known_bits_list: List of known bits (msb first, -1 for unknown), one per instance
+    :param bit_length: Length every instance is padded to
+    :return: Tuple (mask, value) where bit i of mask is set if bit i is known and value holds the known bits
+    """
+    masks = np.zeros(len(known_bits_list), dtype=np.uint64)
+    values = np.zeros(len(known_bits_list), dtype=np.uint64)
+    for j, known_bits in enumerate(known_bits_list):
+        mask = 0
+        value = 0
+        for i, bit in enumerate(padding_input(known_bits, bit_length)[::-1]):
+            if bit != -1:
+                mask |= 1 << i
+                value |= bit << i
+        masks[j] = mask
+        values[j] = value
+    return masks, values
+
+
+def bit_choices(mask, value, i):
+    """
+    Candidate values of bit i for every row.
+
+    :param mask: Known-bit masks of the rows
+    :param value: Known-bit values of the rows
+    :param i: Current bit position
+    :return: Tuple (allowed_0, allowed_1) of boolean arrays
+    """
+    shift = np.uint64(i)
+    known = ((mask >> shift) & np.uint64(1)).astype(bool)
+    bit = ((value >> shift) & np.uint64(1)).astype(bool)
+    return ~known | ~bit, ~known | bit
+
+
+def low_mask(i):
+    """
+    Mask selecting the bits 0..i, as a uint64.
+    """
+    return np.uint64((1 << (i + 1)) - 1)
+
+
+def batch_branch_and_prune(instances):
+    """
+    Run branch_and_prune on many small instances at once, advancing all the searches level by level.
+
+    The frontier of every instance is stored in flat uint64 arrays (one row per node) and each
+    level applies the congruence N = p*q mod 2^(i+1) to the whole batch with vectorized operations.
+
+    :param instances: List of tuples (N, known_bits_p, known_bits_q) with at most 64-bit p and q
+    :return: List with, for each instance, the tuple of bit sequences for p and q if found, None otherwise
+    """
+    if not instances:
+        return []
+
+    bit_length = max(max(len(p), len(q)) for _, p, q in instances)
+    if bit_length > MAX_BATCH_BITS:
+        raise ValueError(f"batch solver supports at most {MAX_BATCH_BITS}-bit factors, got {bit_length}")
+
+    p_mask, p_value = pack_known_bits([p for _, p, _ in instances], bit_length)
+    q_mask, q_value = pack_known_bits([q for _, _, q in instances], bit_length)
+    N_low = np.array([N & ((1 << 64) - 1) for N, _, _ in instances], dtype=np.uint64)
+
+    # One row per node of the frontier: the instance it belongs to and the bits of p and q set so far
+    rows = np.arange(len(instances))
+    p = np.zeros(len(instances), dtype=np.uint64)
+    q = np.zeros(len(instances), dtype=np.uint64)
+
+    for i in range(bit_length):
+        bit = np.uint64(1 << i)
+        mask = low_mask(i)
+        p_allowed = bit_choices(p_mask[rows], p_value[rows], i)
+        q_allowed = bit_choices(q_mask[rows], q_value[rows], i)
+        target = N_low[rows] & mask
+
+        next_rows, next_p, next_q = [], [], []
+        for bit_p in [0, 1]:
+            p_new = p | bit if bit_p else p
+            for bit_q in [0, 1]:
+                q_new = q | bit if bit_q else q
+                keep = p_allowed[bit_p] & q_allowed[bit_q] & (((p_new * q_new) & mask) == target)
+                next_rows.append(rows[keep])
+                next_p.append(p_new[keep])
+                next_q.append(q_new[keep])
+
+        rows = np.concatenate(next_rows)
+        p = np.concatenate(next_p)
+        q = np.concatenate(next_q)
+
+    # Leaves only agree with N on the low bits; verify the full product with Python integers
+    results = [None] * len(instances)
+    for row, p_int, q_int in zip(rows.tolist(), p.tolist(), q.tolist()):
+        N, known_bits_p, known_bits_q = instances[row]
+        if results[row] is None and p_int * q_int == N:
+            length = max(len(known_bits_p), len(known_bits_q))
+            results[row] = (int_to_bits_lsb_start(p_int, length), int_to_bits_lsb_start(q_int, length))
+    return results
+
+
+def batch_branch_and_prune_crt(instances, e):
+    """
+    Run branch_and_prune_crt on many small instances at once, searching every (instance, kp) pair in lockstep.
+
+    The integer relations e*dp - 1 + kp = kp*p, e*dq - 1 + kq = kq*q and N = p*q are checked
+    mod 2^(i+1) on the whole batch at each level. No tree is kept, so the root node of the
+    returned tuples is None.
+
+    :param instances: List of tuples (N, known_bits_dp, known_bits_dq) with at most 64-bit dp and dq
+    :param e: The public exponent shared by the instances
+    :return: List with, for each instance, the same tuple as branch_and_prune_crt or None
+    """
+    if not instances:
+        return []
+
+    bit_length = max(max(len(dp), len(dq)) for _, dp, dq in instances)
+    if bit_length > MAX_BATCH_BITS:
+        raise ValueError(f"batch solver supports at most {MAX_BATCH_BITS}-bit dp and dq, got {bit_length}")
+
+    dp_mask, dp_value = pack_known_bits([dp for _, dp, _ in instances], bit_length)
+    dq_mask, dq_value = pack_known_bits([dq for _, _, dq in instances], bit_length)
+    N_low = np.array([N & ((1 << 64) - 1) for N, _, _ in instances], dtype=np.uint64)
+
+    # One root per (instance, kp) pair with a valid kq
+    roots = []
+    for j, (N, _, _) in enumerate(instances):
+        for kp in range(1, e):
+            kq = find_kq_from_kp(kp, N, e)
+            if kq is not None:
+                roots.append((j, kp, kq))
+    if not roots:
+        return [None] * len(instances)
+
+    rows = np.array([j for j, _, _ in roots])
+    kp = np.array([k for _, k, _ in roots], dtype=np.uint64)
+    kq = np.array([k for _, _, k in roots], dtype=np.uint64)
+    dp = np.zeros(len(roots), dtype=np.uint64)
+    dq = np.zeros(len(roots), dtype=np.uint64)
+    p = np.zeros(len(roots), dtype=np.uint64)
+    q = np.zeros(len(roots), dtype=np.uint64)
+    e_64 = np.uint64(e)
+    one = np.uint64(1)
+
+    for i in range(bit_length):
+        bit = np.uint64(1 << i)
+        mask = low_mask(i)
+        dp_allowed = bit_choices(dp_mask[rows], dp_value[rows], i)
+        dq_allowed = bit_choices(dq_mask[rows], dq_value[rows], i)
+        target = N_low[rows] & mask
+
+        columns = [[] for _ in range(7)]
+        for bit_dp in [0, 1]:
+            dp_new = dp | bit if bit_dp else dp
+            lhs_p = (e_64 * dp_new - one + kp) & mask
+            for bit_dq in [0, 1]:
+                dq_new = dq | bit if bit_dq else dq
+                lhs_q = (e_64 * dq_new - one + kq) & mask
+                allowed = dp_allowed[bit_dp] & dq_allowed[bit_dq]
+                for bit_p in [0, 1]:
+                    p_new = p | bit if bit_p else p
+                    valid_p = allowed & (((p_new * kp) & mask) == lhs_p)
+                    for bit_q in [0, 1]:
+                        q_new = q | bit if bit_q else q
+                        keep = valid_p & (((q_new * kq) & mask) == lhs_q) & (((p_new * q_new) & mask) == target)
+                        for column, values in zip(columns, (rows, kp, kq, dp_new, dq_new, p_new, q_new)):
+                            column.append(values[keep])
+
+        rows, kp, kq, dp, dq, p, q = (np.concatenate(column) for column in columns)
+
+    results = [None] * len(instances)
+    for row, kp_int, kq_int, dp_int, dq_int, p_int, q_int in zip(
+            rows.tolist(), kp.tolist(), kq.tolist(), dp.tolist(), dq.tolist(), p.tolist(), q.tolist()):
+        N, known_bits_dp, known_bits_dq = instances[row]
+        if (p_int * kp_int != e * dp_int - 1 + kp_int or q_int * kq_int != e * dq_int - 1 + kq_int
+                or p_int * q_int != N):
+            continue
+        # Keep the smallest kp, the one branch_and_prune_crt would return
+        if results[row] is None or kp_int < results[row][5]:
+            length = max(len(known_bits_dp), len(known_bits_dq))
+            results[row] = (int_to_bits_lsb_start(p_int, length), int_to_bits_lsb_start(q_int, length),
+                            int_to_bits_lsb_start(dp_int, length), int_to_bits_lsb_start(dq_int, length),
+                            None, kp_int, kq_int)
+    return results
+
+
+def batch_sweep(revealrate, bitsize, count, e=17):
+    """
+    Time the batch solvers against one branch_and_prune / branch_and_prune_crt call per instance.
+
+    :param revealrate: The rate at which bits are revealed (0 to 1).
+    :param bitsize: The desired bitsize for p and q.
+    :param count: Number of generated instances.
+    :param e: The public exponent used for the CRT instances.
+    :return: Dictionary with the elapsed times of the four runs
+    """
+    from branch_prune import branch_and_prune
+    from crt_pruning import branch_and_prune_crt
+
+    instances = []
+    for _ in range(count):
+        N, p, q, p_bits, q_bits, p_erased, q_erased = example_generator(revealrate, bitsize)
+        instances.append((N, p_erased, q_erased))
+    crt_instances = []
+    for _ in range(count):
+        N, dp_bits, dq_bits, dp, dq, dp_erased, dq_erased, p, q = example_generator_crt_pruning(revealrate, bitsize, e)
+        crt_instances.append((N, dp_erased, dq_erased))
+
+    times = {}
+    start_time = time.perf_counter()
+    for N, p_erased, q_erased in instances:
+        branch_and_prune(N, p_erased, q_erased)
+    times["branch_prune"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    batch_branch_and_prune(instances)
+    times["batch_branch_prune"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for N, dp_erased, dq_erased in crt_instances:
+        branch_and_prune_crt(N, e, dp_erased, dq_erased)
+    times["crt_pruning"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    batch_branch_and_prune_crt(crt_instances, e)
+    times["batch_crt_pruning"] = time.perf_counter() - start_time
+
+    return times
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare the batch solvers with the per-instance engines')
+    parser.add_argument('--revealrate', type=float, default=0.6, help='Bit reveal rate for testing')
+    parser.add_argument('--bitsize', type=int, default=16, help='Bit size for RSA components')
+    parser.add_argument('--count', type=int, default=200, help='Number of instances in the batch')
+    parser.add_argument('--e', type=int, default=17, help='Public exponent for RSA')
+    args = parser.parse_args()
+
+    times = batch_sweep(args.revealrate, args.bitsize, args.count, args.e)
+    for name, elapsed in times.items():
+        print(f"{name}: {elapsed:.4f} seconds")
+    print(f"branch_prune speedup: {times['branch_prune'] / times['batch_branch_prune']:.1f}x")
+    print(f"crt_pruning speedup: {times['crt_pruning'] / times['batch_crt_pruning']:.1f}x")
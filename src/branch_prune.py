@@ -6,25 +6,111 @@ from helpers import *
 
 
 class TreeNode:
-    def __init__(self, p_bits, q_bits, bit_pos):
+    def __init__(self, p_bits, q_bits, bit_pos, symmetric=False):
         self.p_bits = p_bits
         self.q_bits = q_bits
         self.bit_pos = bit_pos
         self.children = []
+        self.node_id = None
+        # True while p and q are equal so far and the leak cannot tell them apart
+        self.symmetric = symmetric
 
     def add_child(self, child_node):
         self.children.append(child_node)
 
+    def __repr__(self):
+        return f"TreeNode(p_bits={self.p_bits}, q_bits={self.q_bits}, bit_pos={self.bit_pos})"
 
-def build_tree_and_prune_dfs(N, known_bits_p, known_bits_q):
+
+def expand(N, known_bits_p, known_bits_q, p, q, i, symmetric):
     """
-    Build the tree and prune invalid branches using DFS to find p and q.
+    Generate the children of a node of level i that pass the check mod 2^(i+1).
 
     :param N: The product of p and q
-    :param known_bits_p: Known bits of p
-    :param known_bits_q: Known bits of q
-    :param bit_length: Length of the bit sequences
-    :return: Tuple of bit sequences for p and q if found, None otherwise
+    :param known_bits_p: Known bits of p (lsb first)
+    :param known_bits_q: Known bits of q (lsb first)
+    :param p: Bits of p of the node
+    :param q: Bits of q of the node
+    :param i: Level of the node
+    :param symmetric: Whether the node is symmetric (see build_tree_and_prune_dfs)
+    :return: List of tuples (p_bits, q_bits, symmetric) for the children, in DFS push order
+    """
+    p = set_bit(p, i, known_bits_p[i])
+    q = set_bit(q, i, known_bits_q[i])
+
+    children = []
+
+    def add_child_and_prune(p_bits, q_bits):
+        if is_valid(p_bits, q_bits, i, N):
+            children.append((p_bits, q_bits, symmetric and p_bits[i] == q_bits[i]))
+
+    if p[i] == -1 and q[i] == -1:
+        for bit_p in [0, 1]:
+            for bit_q in [0, 1]:
+                if symmetric and bit_p > bit_q:
+                    continue  # Mirror of the (0, 1) branch
+                p_bits_new = set_bit(p, i, bit_p)
+                q_bits_new = set_bit(q, i, bit_q)
+                add_child_and_prune(p_bits_new, q_bits_new)
+
+    elif p[i] == -1:
+        for bit_p in [0, 1]:
+            p_bits_new = set_bit(p, i, bit_p)
+            q_bits_new = q
+            add_child_and_prune(p_bits_new, q_bits_new)
+
+    elif q[i] == -1:
+        for bit_q in [0, 1]:
+            q_bits_new = set_bit(q, i, bit_q)
+            p_bits_new = p
+            add_child_and_prune(p_bits_new, q_bits_new)
+
+    else:
+        add_child_and_prune(p, q)
+
+    return children
+
+
+def complete(N, known_bits_p, known_bits_q, p, q, i, p_known):
+    """
+    Solve the subtree of a node of level i from which every remaining bit of p (or of q) is known.
+
+    The known bits fix the factor, so the subtree holds at most one leaf that can be a
+    solution: the other factor is N divided by it.
+
+    :param N: The product of p and q
+    :param known_bits_p: Known bits of p (lsb first)
+    :param known_bits_q: Known bits of q (lsb first)
+    :param p: Bits of p of the node
+    :param q: Bits of q of the node
+    :param i: Level of the node
+    :param p_known: True if the remaining bits of p are known, False if those of q are
+    :return: Tuple of bit sequences for p and q if the subtree holds a solution, None otherwise
+    """
+    if not p_known:
+        solution = complete(N, known_bits_q, known_bits_p, q, p, i, True)
+        return None if solution is None else solution[::-1]
+
+    bit_length = len(known_bits_p)
+    p_value = bits_to_int(p[:i]) | (bits_to_int(known_bits_p[i:]) << i)
+    if p_value == 0 or N % p_value:
+        return None
+    q_value = N // p_value
+    if q_value >> bit_length or q_value & ((1 << i) - 1) != bits_to_int(q[:i]):
+        return None
+    q_bits = int_to_bits_lsb_start(q_value, bit_length)
+    if any(known != -1 and known != bit for known, bit in zip(known_bits_q, q_bits)):
+        return None
+    return int_to_bits_lsb_start(p_value, bit_length), q_bits
+
+
+def prepare(known_bits_p, known_bits_q):
+    """
+    Pad and reverse the known bits and build the bits of the root.
+
+    :param known_bits_p: Known bits of p (msb first)
+    :param known_bits_q: Known bits of q (msb first)
+    :return: Tuple (known_bits_p, known_bits_q, p_init, q_init, symmetric), known bits lsb first
     """
     bit_length = max(len(known_bits_p), len(known_bits_q))
 
@@ -32,69 +118,117 @@ def build_tree_and_prune_dfs(N, known_bits_p, known_bits_q):
 
     known_bits_p = known_bits_p[::-1] ## Reverse the list
     known_bits_q = known_bits_q[::-1] ## Reverse the list
-    
+
     p_init = root_bits(known_bits_p[0], bit_length)
     q_init = root_bits(known_bits_q[0], bit_length)
 
-    stack = [TreeNode(p_init, q_init, 0)] ## Initialize the stack with the root
+    symmetric_from = symmetric_suffixes(known_bits_p, known_bits_q)
+    return known_bits_p, known_bits_q, p_init, q_init, symmetric_from[0]
+
+
+def build_tree_and_prune_dfs(N, known_bits_p, known_bits_q, exporter=None, monitor=None):
+    """
+    Build the tree and prune invalid branches using DFS to find p and q.
+
+    While p and q are equal on the bits fixed so far and their remaining known bits match,
+    a branch (p, q) and its mirror (q, p) lead to mirrored subtrees, so only the branch
+    with p <= q is explored.
+
+    Once every remaining bit of p or of q is known, the subtree of a node is solved by a
+    single division (see complete) instead of being walked. This happens at a single level,
+    computed once, so other nodes pay one comparison for it.
+
+    :param N: The product of p and q
+    :param known_bits_p: Known bits of p
+    :param known_bits_q: Known bits of q
+    :param exporter: Optional TreeExporter receiving every node as it is created
+    :param monitor: Optional MemoryMonitor receiving the stack size at every step
+    :return: Tuple of bit sequences for p and q if found, None otherwise
+    """
+    bit_length = max(len(known_bits_p), len(known_bits_q))
+    known_bits_p, known_bits_q, p_init, q_init, symmetric = prepare(known_bits_p, known_bits_q)
+    p_known_from = known_suffix_start(known_bits_p)
+    q_known_from = known_suffix_start(known_bits_q)
+    # No node below this level is expanded, so the completion is only tried there
+    completion_level = min(p_known_from, q_known_from)
+
+    root_node = TreeNode(p_init, q_init, 0, symmetric)
+    if exporter is not None:
+        root_node.node_id = exporter.add(None, 0, {})
+    stack = [root_node] ## Initialize the stack with the root
     
     while stack:
+        if monitor is not None:
+            monitor.step(len(stack))
         node = stack.pop()
         p, q, i = node.p_bits, node.q_bits, node.bit_pos
              
         if i == bit_length:
-            if is_valid(p, q, i, N) and (bits_to_int(p) * bits_to_int(q) == N):
+            if is_valid(p, q, i, N) and verify_factors(p, q, N):
                 return p, q
 
+        elif i == completion_level:
+            solution = complete(N, known_bits_p, known_bits_q, p, q, i, p_known_from <= i)
+            if solution is not None:
+                return solution
+
         elif i < bit_length:
+            # Same children as expand, built inline to save a tuple per child on the hot path
             p = set_bit(p, i, known_bits_p[i])
             q = set_bit(q, i, known_bits_q[i])
+            symmetric = node.symmetric
+            # The check of is_valid, with N mod 2^(i+1) computed once per node
+            modulus = 1 << (i + 1)
+            N_low = N % modulus
 
             valid_children = []
 
             def add_child_and_prune(p_bits, q_bits):
-                if is_valid(p_bits, q_bits, i, N):
-                    child_node = TreeNode(p_bits, q_bits, i + 1)
+                if bits_to_int(p_bits) * bits_to_int(q_bits) % modulus == N_low:
+                    child_node = TreeNode(p_bits, q_bits, i + 1, symmetric and p_bits[i] == q_bits[i])
+                    if exporter is not None:
+                        child_node.node_id = exporter.add(node.node_id, i + 1, {"p": p_bits[i], "q": q_bits[i]})
                     valid_children.append(child_node)
                     stack.append(child_node)
 
             if p[i] == -1 and q[i] == -1:
                 for bit_p in [0, 1]:
                     for bit_q in [0, 1]:
-                        p_bits_new = set_bit(p, i, bit_p)
-                        q_bits_new = set_bit(q, i, bit_q)
-                        add_child_and_prune(p_bits_new, q_bits_new)
-              
+                        if symmetric and bit_p > bit_q:
+                            continue  # Mirror of the (0, 1) branch
+                        add_child_and_prune(set_bit(p, i, bit_p), set_bit(q, i, bit_q))
+
             elif p[i] == -1:
                 for bit_p in [0, 1]:
-                    p_bits_new = set_bit(p, i, bit_p)
-                    q_bits_new = q
-                    add_child_and_prune(p_bits_new, q_bits_new)
-               
+                    add_child_and_prune(set_bit(p, i, bit_p), q)
+
             elif q[i] == -1:
                 for bit_q in [0, 1]:
-                    q_bits_new = set_bit(q, i, bit_q)
-                    p_bits_new = p
-                    add_child_and_prune(p_bits_new, q_bits_new)
-              
+                    add_child_and_prune(p, set_bit(q, i, bit_q))
+
             else:
                 add_child_and_prune(p, q)
-            
 
             node.children = valid_children
          
 
     return None
 
-def branch_and_prune(N, known_bits_p, known_bits_q):
+def branch_and_prune(N, known_bits_p, known_bits_q, exporter=None, monitor=None, workers=None):
     """
     Branch and prune algorithm to factorize N, knowing non-consecutive bits of the secret values p and q
 
     :param N: The product of p and q
     :param known_bits_p: Known bits of p
     :param known_bits_q: Known bits of q
-    :param bit_length: Length of the bit sequences of p and q
+    :param exporter: Optional TreeExporter receiving every node as it is created
+    :param monitor: Optional MemoryMonitor receiving the stack size at every step
+    :param workers: Search with this many work-stealing workers (see parallel_search); the
+                    exporter and the monitor are not used then
     :return: Tuple of bit sequences for p and q if found, None otherwise
     """
-    return build_tree_and_prune_dfs(N, known_bits_p, known_bits_q)
+    if workers is not None and workers > 1:
+        from parallel_search import parallel_branch_and_prune
+        return parallel_branch_and_prune(N, known_bits_p, known_bits_q, workers)
+    return build_tree_and_prune_dfs(N, known_bits_p, known_bits_q, exporter, monitor)
 
@@ -4,13 +4,16 @@ from rsa import mod_inverse
 from helpers import *
 
 class TreeNode:
-    def __init__(self, p_bits, q_bits, dp_bits, dq_bits, bit_pos):
+    def __init__(self, p_bits, q_bits, dp_bits, dq_bits, bit_pos, symmetric=False):
         self.p_bits = p_bits
         self.q_bits = q_bits
         self.dp_bits = dp_bits
         self.dq_bits = dq_bits
         self.bit_pos = bit_pos
         self.children = []
+        self.node_id = None
+        # True while kp = kq, (dp, p) and (dq, q) are equal so far and the leak cannot tell them apart
+        self.symmetric = symmetric
 
     def add_child(self, child_node):
         self.children.append(child_node)
@@ -19,15 +22,186 @@ class TreeNode:
         return (f"TreeNode(p_bits={self.p_bits}, q_bits={self.q_bits}, "
                 f"dp_bits={self.dp_bits}, dq_bits={self.dq_bits}, bit_pos={self.bit_pos})")
 
-def build_tree_and_prune_dfs(N, e, kp, known_bits_dp, known_bits_dq):
+def expand(N, e, kp, kq, known_bits_dp, known_bits_dq, p_bits, q_bits, dp_bits, dq_bits, i, symmetric):
+    """
+    Generate the children of a node of level i that pass the checks mod 2^(i+1).
+
+    :param N: The product of p and q
+    :param e: The public exponent
+    :param kp: Value of kp
+    :param kq: Value of kq
+    :param known_bits_dp: Known bits of dp (lsb first)
+    :param known_bits_dq: Known bits of dq (lsb first)
+    :param i: Level of the node
+    :param symmetric: Whether the node is symmetric (see build_tree_and_prune_dfs)
+    :return: List of tuples (p_bits, q_bits, dp_bits, dq_bits, symmetric) for the children, in DFS push order
+    """
+    dp_bits = set_bit(dp_bits, i, known_bits_dp[i])
+    dq_bits = set_bit(dq_bits, i, known_bits_dq[i])
+
+    children = []
+    # The congruences k * p = e * dp - 1 + k mod 2^(i+1) are solved with the 2-adic inverses
+    # of kp and kq, lifted once per (k, bit_length), instead of trying both bits of p and q
+    t_p, kp_inverse = lift_2adic_inverse(kp, len(p_bits))
+    t_q, kq_inverse = lift_2adic_inverse(kq, len(q_bits))
+    low_mask = (1 << i) - 1
+    p_low = bits_to_int(p_bits) & low_mask
+    q_low = bits_to_int(q_bits) & low_mask
+
+    def add_child_and_prune(dp_bits, dq_bits, p_bits, q_bits):               
+        dp = bits_to_int(dp_bits)
+        dq = bits_to_int(dq_bits)
+
+        p_candidates = congruence_bit_candidates((e*dp) - 1 + kp, t_p, kp_inverse, p_low, i)
+        q_candidates = congruence_bit_candidates((e*dq) - 1 + kq, t_q, kq_inverse, q_low, i)
+
+        for p_bit_i in p_candidates :
+            for q_bit_i in q_candidates :
+                if symmetric and (dp_bits[i], p_bit_i) > (dq_bits[i], q_bit_i):
+                    continue  # Mirror of a branch explored with dp and p swapped with dq and q
+                p_bits = set_bit(p_bits, i, p_bit_i)
+                q_bits = set_bit(q_bits, i, q_bit_i)
+
+                if is_valid(p_bits, q_bits, i, N) : 
+                    children.append((p_bits, q_bits, dp_bits, dq_bits,
+                                     symmetric and dp_bits[i] == dq_bits[i] and p_bit_i == q_bit_i))
+
+    if dp_bits[i] == -1 and dq_bits[i] == -1:
+        for bit_dp in [0, 1]:
+            for bit_dq in [0, 1]:
+                dp_bits_new = set_bit(dp_bits, i, bit_dp)
+                dq_bits_new = set_bit(dq_bits, i, bit_dq)
+                add_child_and_prune(dp_bits_new, dq_bits_new, p_bits, q_bits)
+
+    elif dp_bits[i] == -1:
+        for bit_dp in [0, 1]:
+            dp_bits_new = set_bit(dp_bits, i, bit_dp)
+            dq_bits_new = dq_bits
+            add_child_and_prune(dp_bits_new, dq_bits_new, p_bits, q_bits)
+
+    elif dq_bits[i] == -1:
+        for bit_dq in [0, 1]:
+            dq_bits_new = set_bit(dq_bits, i, bit_dq)
+            dp_bits_new = dp_bits
+            add_child_and_prune(dp_bits_new, dq_bits_new, p_bits, q_bits)
+
+    else:
+        add_child_and_prune(dp_bits, dq_bits, p_bits, q_bits)
+
+    return children
+
+
+def complete(N, e, kp, kq, known_bits_dp, known_bits_dq, p_bits, q_bits, dp_bits, dq_bits, i, dp_known):
+    """
+    Solve the subtree of a node of level i from which every remaining bit of dp (or of dq) is known.
+
+    The known bits fix dp, hence p = (e*dp - 1 + kp) / kp, q = N / p and dq = (kq*(q - 1) + 1) / e,
+    so the subtree holds at most one leaf that can be a solution.
+
+    :param N: The product of p and q
+    :param e: The public exponent
+    :param kp: Value of kp
+    :param kq: Value of kq
+    :param known_bits_dp: Known bits of dp (lsb first)
+    :param known_bits_dq: Known bits of dq (lsb first)
+    :param i: Level of the node
+    :param dp_known: True if the remaining bits of dp are known, False if those of dq are
+    :return: Tuple (p_bits, q_bits, dp_bits, dq_bits) if the subtree holds a solution, None otherwise
+    """
+    if not dp_known:
+        solution = complete(N, e, kq, kp, known_bits_dq, known_bits_dp, q_bits, p_bits, dq_bits, dp_bits, i, True)
+        return None if solution is None else (solution[1], solution[0], solution[3], solution[2])
+
+    bit_length = len(known_bits_dp)
+    low_mask = (1 << i) - 1
+    dp = bits_to_int(dp_bits[:i]) | (bits_to_int(known_bits_dp[i:]) << i)
+    # With kp = 0 the relation would be e*dp = 1, which has no solution for e > 1
+    if kp == 0 or (e * dp - 1 + kp) % kp:
+        return None
+    p = (e * dp - 1 + kp) // kp
+    if p == 0 or N % p:
+        return None
+    q = N // p
+    if (kq * (q - 1) + 1) % e:
+        return None
+    dq = (kq * (q - 1) + 1) // e
+    for value, bits in ((p, p_bits), (q, q_bits), (dq, dq_bits)):
+        if value < 0 or value >> bit_length or value & low_mask != bits_to_int(bits[:i]):
+            return None
+    dq_bits = int_to_bits_lsb_start(dq, bit_length)
+    if any(known != -1 and known != bit for known, bit in zip(known_bits_dq, dq_bits)):
+        return None
+    return (int_to_bits_lsb_start(p, bit_length), int_to_bits_lsb_start(q, bit_length),
+            int_to_bits_lsb_start(dp, bit_length), dq_bits)
+
+
+def prepare(known_bits_dp, known_bits_dq):
+    """
+    Reverse the known bits and build the bits of the roots.
+
+    :param known_bits_dp: Known bits of dp (msb first)
+    :param known_bits_dq: Known bits of dq (msb first)
+    :return: Tuple (known_bits_dp, known_bits_dq, p_init, q_init, dp_init, dq_init, symmetric),
+             known bits lsb first, symmetric telling whether the leak cannot tell dp from dq
+    """
+    bit_length = max(len(known_bits_dp), len(known_bits_dq))
+
+    known_bits_dp = known_bits_dp[::-1]  # Reverse the list
+    known_bits_dq = known_bits_dq[::-1]  # Reverse the list
+
+    dp_init = root_bits(known_bits_dp[0], bit_length)
+    dq_init = root_bits(known_bits_dq[0], bit_length)
+    p_init = [0] * bit_length
+    q_init = [0] * bit_length
+
+    symmetric_from = symmetric_suffixes(known_bits_dp, known_bits_dq)
+    return known_bits_dp, known_bits_dq, p_init, q_init, dp_init, dq_init, symmetric_from[0]
+
+
+def kp_values(N, e, known_bits_dp, known_bits_dq):
+    """
+    List the (kp, kq) pairs whose trees branch_and_prune_crt searches, in order.
+
+    When the leak cannot tell dp from dq, the tree of (kp, kq) with kp > kq mirrors the
+    tree of (kq, kp), which comes first, so it is left out.
+
+    :param N: The product of p and q
+    :param e: The public exponent
+    :param known_bits_dp: Known bits of dp (msb first)
+    :param known_bits_dq: Known bits of dq (msb first)
+    :return: List of tuples (kp, kq)
+    """
+    symmetric = symmetric_suffixes(known_bits_dp[::-1], known_bits_dq[::-1])[0]
+    pairs = []
+    for kp in range(1, e):  # Assuming kp ranges from 1 to e-1
+        kq = find_kq_from_kp(kp, N, e)
+        if kq is None:
+            continue
+        # kp and kq are swapped by the mirror, whose tree was searched when kp was kq
+        if symmetric and 1 <= kq < kp and find_kq_from_kp(kq, N, e) == kp:
+            continue
+        pairs.append((kp, kq))
+    return pairs
+
+
+def build_tree_and_prune_dfs(N, e, kp, known_bits_dp, known_bits_dq, exporter=None, monitor=None):
     """
     Build the tree and prune invalid branches using DFS to find p and q.
 
+    When kp = kq, a branch and its mirror (dp and p swapped with dq and q) lead to mirrored
+    subtrees as long as the state is symmetric, so only the branch with (dp, p) <= (dq, q)
+    is explored.
+
+    Once every remaining bit of dp or of dq is known, the subtree of a node is solved with
+    kp, kq and a single division (see complete) instead of being walked.
+
     :param N: The product of p and q
     :param e: The public exponent
     :param kp: Known bits of kp
     :param known_bits_dp: Known bits of dp
     :param known_bits_dq: Known bits of dq
+    :param exporter: Optional TreeExporter receiving every node as it is created
+    :param monitor: Optional MemoryMonitor receiving the stack size at every step
     :return: Tuple of bit sequences for p and q if found, None otherwise
     """
     
@@ -36,19 +210,20 @@ def build_tree_and_prune_dfs(N, e, kp, known_bits_dp, known_bits_dq):
         return None
     
     bit_length = max(len(known_bits_dp), len(known_bits_dq))
+    known_bits_dp, known_bits_dq, p_init, q_init, dp_init, dq_init, symmetric = prepare(known_bits_dp, known_bits_dq)
+    dp_known_from = known_suffix_start(known_bits_dp)
+    dq_known_from = known_suffix_start(known_bits_dq)
+    # No node below this level is expanded, so the completion is only tried there
+    completion_level = min(dp_known_from, dq_known_from)
 
-    known_bits_dp = known_bits_dp[::-1]  # Reverse the list
-    known_bits_dq = known_bits_dq[::-1]  # Reverse the list
-    
-    dp_init = root_bits(known_bits_dp[0], bit_length)
-    dq_init = root_bits(known_bits_dq[0], bit_length)
-    p_init = [0] * bit_length
-    q_init = [0] * bit_length
-
-    root_node = TreeNode(p_init, q_init, dp_init, dq_init, 0)
+    root_node = TreeNode(p_init, q_init, dp_init, dq_init, 0, kp == kq and symmetric)
+    if exporter is not None:
+        root_node.node_id = exporter.add(None, 0, {"kp": kp, "kq": kq})
     stack = [root_node]  # Initialize the stack with the root
     
     while stack:
+        if monitor is not None:
+            monitor.step(len(stack))
         node = stack.pop()
         p_bits, q_bits, dp_bits, dq_bits, i = node.p_bits, node.q_bits, node.dp_bits, node.dq_bits, node.bit_pos
              
@@ -56,59 +231,27 @@ def build_tree_and_prune_dfs(N, e, kp, known_bits_dp, known_bits_dq):
             if  verify_integer_relations(dp_bits,dq_bits,p_bits,q_bits,e,N,kp,kq):
                 return p_bits, q_bits, dp_bits, dq_bits, root_node, kp, kq
 
-        elif i < bit_length:    
-            dp_bits = set_bit(dp_bits, i, known_bits_dp[i])
-            dq_bits = set_bit(dq_bits, i, known_bits_dq[i])
+        elif i == completion_level:
+            solution = complete(N, e, kp, kq, known_bits_dp, known_bits_dq, p_bits, q_bits, dp_bits, dq_bits,
+                                i, dp_known_from <= i)
+            if solution is not None:
+                return solution + (root_node, kp, kq)
 
+        elif i < bit_length:    
             valid_children = []
-
-            def add_child_and_prune(dp_bits, dq_bits, p_bits, q_bits):               
-                dp = bits_to_int(dp_bits)
-                dq = bits_to_int(dq_bits)
-
-                lhs_p = (((e*dp) - 1 + kp) % (1 << (i + 1)))
-                lhs_q = (((e*dq) - 1 + kq) % (1 << (i + 1)))
-
-                for p_bit_i in [0, 1] : 
-                    for q_bit_i in [0, 1] : 
-                        p_bits = set_bit(p_bits, i, p_bit_i)
-                        q_bits = set_bit(q_bits, i, q_bit_i)
-                        bol1 = (((bits_to_int(p_bits) * kp )%  (1 << (i + 1))) == lhs_p)
-                        bol2 = (((bits_to_int(q_bits) * kq)%  (1 << (i + 1))) == lhs_q)
-                        bol3 = is_valid(p_bits, q_bits, i, N)
-
-                        if (bol1 and bol2 and bol3) : 
-                            child_node = TreeNode(p_bits, q_bits, dp_bits, dq_bits, i + 1)
-                            valid_children.append(child_node)
-                            stack.append(child_node)
-                    
-
-            if dp_bits[i] == -1 and dq_bits[i] == -1:
-                for bit_dp in [0, 1]:
-                    for bit_dq in [0, 1]:
-                        dp_bits_new = set_bit(dp_bits, i, bit_dp)
-                        dq_bits_new = set_bit(dq_bits, i, bit_dq)
-                        add_child_and_prune(dp_bits_new, dq_bits_new, p_bits, q_bits)
-              
-            elif dp_bits[i] == -1:
-                for bit_dp in [0, 1]:
-                    dp_bits_new = set_bit(dp_bits, i, bit_dp)
-                    dq_bits_new = dq_bits
-                    add_child_and_prune(dp_bits_new, dq_bits_new, p_bits, q_bits)
-               
-            elif dq_bits[i] == -1:
-                for bit_dq in [0, 1]:
-                    dq_bits_new = set_bit(dq_bits, i, bit_dq)
-                    dp_bits_new = dp_bits
-                    add_child_and_prune(dp_bits_new, dq_bits_new, p_bits, q_bits)
-              
-            else:
-                add_child_and_prune(dp_bits, dq_bits, p_bits, q_bits)
+            for child in expand(N, e, kp, kq, known_bits_dp, known_bits_dq, p_bits, q_bits, dp_bits, dq_bits,
+                                i, node.symmetric):
+                child_node = TreeNode(*child[:4], i + 1, child[4])
+                if exporter is not None:
+                    child_node.node_id = exporter.add(node.node_id, i + 1, {"dp": child[2][i], "dq": child[3][i],
+                                                                            "p": child[0][i], "q": child[1][i]})
+                valid_children.append(child_node)
+                stack.append(child_node)
             
             node.children = valid_children
     return None
 
-def branch_and_prune_crt(N, e, known_bits_dp, known_bits_dq):
+def branch_and_prune_crt(N, e, known_bits_dp, known_bits_dq, exporter=None, monitor=None, workers=None):
     """
     Branch and prune algorithm to factorize N, knowing non-consecutive bits of the secret values p and q.
 
@@ -116,11 +259,17 @@ def branch_and_prune_crt(N, e, known_bits_dp, known_bits_dq):
     :param e: The public exponent
     :param known_bits_dp: Known bits of dp
     :param known_bits_dq: Known bits of dq
+    :param exporter: Optional TreeExporter receiving every node as it is created
+    :param monitor: Optional MemoryMonitor receiving the stack size at every step
+    :param workers: Search with this many work-stealing workers (see parallel_search); the
+                    exporter and the monitor are not used then, and the root node is None
     :return: Tuple of bit sequences for p and q if found, None otherwise
     """
-    for kp in range(1, e):  # Assuming kp ranges from 1 to e-1
-        result = build_tree_and_prune_dfs(N, e, kp, known_bits_dp, known_bits_dq)
+    if workers is not None and workers > 1:
+        from parallel_search import parallel_branch_and_prune_crt
+        return parallel_branch_and_prune_crt(N, e, known_bits_dp, known_bits_dq, workers)
+    for kp, kq in kp_values(N, e, known_bits_dp, known_bits_dq):
+        result = build_tree_and_prune_dfs(N, e, kp, known_bits_dp, known_bits_dq, exporter, monitor)
         if result is not None:
            return result
     return None
-
@@ -0,0 +1,366 @@
+import importlib.util
+import json
+import random
+import sys
+import time
+import branch_prune
+import crt_pruning
+import leak_models
+from result_cache import matches_known_bits
+from helpers import *
+
+
+DEFAULT_BITSIZES = [8, 16, 24, 32, 48, 64]
+DEFAULT_RATES = [0.55, 0.6, 0.7, 0.8]
+DEFAULT_PARALLEL_WORKERS = 2
+REPORT_INTERVAL = 25
+
+# Engines by kind: name -> (function taking the arguments of the reference engine, largest bit size or None)
+ENGINES = {"branch_prune": {}, "crt_pruning": {}}
+REFERENCE = "reference"
+
+# Engines left out because a module they need is missing: (kind, name) -> missing module
+UNAVAILABLE = {}
+
+# Exceptions that come from the environment rather than from the leak given to the engine.
+# An engine raising one is reported and dropped instead of being shrunk on as a failure
+ENVIRONMENT_ERRORS = (ImportError,)
+UNAVAILABLE_PREFIX = "unavailable: "
+
+
+def register_engine(kind, name, function, max_bits=None, requires=()):
+    """
+    Add an engine to the fuzzer. It is called with the arguments of the reference engine,
+    (N, known_bits_p, known_bits_q) or (N, e, known_bits_dp, known_bits_dq), and must return
+    the same tuple as branch_and_prune or branch_and_prune_crt, or None.
+
+    :param kind: "branch_prune" or "crt_pruning"
+    :param name: Name of the engine in the reports
+    :param function: The engine
+    :param max_bits: Largest length of the known bits the engine supports (None for no limit)
+    :param requires: Names of the modules the engine needs; it is not registered if one is missing
+    """
+    for module in requires:
+        if importlib.util.find_spec(module) is None:
+            UNAVAILABLE[(kind, name)] = module
+            return
+    ENGINES[kind][name] = (function, max_bits)
+
+
+def batch_engine(N, known_bits_p, known_bits_q):
+    from batch_solver import batch_branch_and_prune
+    return batch_branch_and_prune([(N, known_bits_p, known_bits_q)])[0]
+
+
+def batch_engine_crt(N, e, known_bits_dp, known_bits_dq):
+    from batch_solver import batch_branch_and_prune_crt
+    return batch_branch_and_prune_crt([(N, known_bits_dp, known_bits_dq)], e)[0]
+
+
+def parallel_engine(N, known_bits_p, known_bits_q):
+    from parallel_search import parallel_branch_and_prune
+    return parallel_branch_and_prune(N, known_bits_p, known_bits_q, DEFAULT_PARALLEL_WORKERS, "process")
+
+
+def parallel_engine_crt(N, e, known_bits_dp, known_bits_dq):
+    from parallel_search import parallel_branch_and_prune_crt
+    return parallel_branch_and_prune_crt(N, e, known_bits_dp, known_bits_dq, DEFAULT_PARALLEL_WORKERS, "process")
+
+
+def thread_engine(N, known_bits_p, known_bits_q):
+    from parallel_search import parallel_branch_and_prune
+    return parallel_branch_and_prune(N, known_bits_p, known_bits_q, DEFAULT_PARALLEL_WORKERS, "thread")
+
+
+def thread_engine_crt(N, e, known_bits_dp, known_bits_dq):
+    from parallel_search import parallel_branch_and_prune_crt
+    return parallel_branch_and_prune_crt(N, e, known_bits_dp, known_bits_dq, DEFAULT_PARALLEL_WORKERS, "thread")
+
+
+register_engine("branch_prune", REFERENCE, branch_prune.branch_and_prune)
+register_engine("branch_prune", "batch", batch_engine, 64, requires=("numpy",))
+register_engine("branch_prune", "parallel", parallel_engine)
+register_engine("branch_prune", "threads", thread_engine)
+register_engine("crt_pruning", REFERENCE, crt_pruning.branch_and_prune_crt)
+# dp and dq are padded to the size of N, twice the bit size
+register_engine("crt_pruning", "batch", batch_engine_crt, 64, requires=("numpy",))
+register_engine("crt_pruning", "parallel", parallel_engine_crt)
+register_engine("crt_pruning", "threads", thread_engine_crt)
+
+
+class FuzzCase:
+    """
+    A generated instance: the leak given to the engines and the secret bits it was taken
+    from (p and q, or dp and dq, msb first).
+    """
+
+    def __init__(self, kind, N, e, secret_a, secret_b, known_a, known_b, description):
+        self.kind = kind
+        self.N = N
+        self.e = e
+        self.secret_a = secret_a
+        self.secret_b = secret_b
+        self.known_a = known_a
+        self.known_b = known_b
+        self.description = description
+
+    def arguments(self):
+        if self.kind == "branch_prune":
+            return self.N, self.known_a, self.known_b
+        return self.N, self.e, self.known_a, self.known_b
+
+    def with_known_bits(self, known_a, known_b):
+        return FuzzCase(self.kind, self.N, self.e, self.secret_a, self.secret_b, known_a, known_b, self.description)
+
+    def unknown_positions(self):
+        return ([("a", i) for i, bit in enumerate(self.known_a) if bit == -1]
+                + [("b", i) for i, bit in enumerate(self.known_b) if bit == -1])
+
+    def to_dict(self):
+        pattern = lambda bits: "".join("?" if bit == -1 else str(bit) for bit in bits)
+        return {"kind": self.kind, "N": self.N, "e": self.e, "case": self.description,
+                "known_a": pattern(self.known_a), "known_b": pattern(self.known_b),
+                "unknown_bits": len(self.unknown_positions())}
+
+
+def generate_case(kind, bitsize, model, rate, seed, e=17):
+    """
+    Generate an instance with example_generator or example_generator_crt_pruning under a seed.
+
+    The iid model keeps the erasure of the generator; the other leak models of leak_models
+    erase the full bits again.
+
+    :param kind: "branch_prune" or "crt_pruning"
+    :param bitsize: Bit size of p and q
+    :param model: Name of the leak model, one of leak_models.LEAK_MODELS
+    :param rate: Reveal rate
+    :param seed: Seed of the instance
+    :param e: The public exponent of CRT instances
+    :return: FuzzCase
+    """
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        if kind == "branch_prune":
+            N, p, q, secret_a, secret_b, known_a, known_b = example_generator(rate, bitsize)
+        else:
+            N, secret_a, secret_b, dp, dq, known_a, known_b, p, q = example_generator_crt_pruning(rate, bitsize, e)
+    finally:
+        random.setstate(state)
+    if model != "iid":
+        known_a, known_b = leak_models.leak_pair(model, secret_a, secret_b, rate, random.Random(seed))
+    description = {"bitsize": bitsize, "model": model, "rate": rate, "seed": seed}
+    return FuzzCase(kind, N, e, secret_a, secret_b, known_a, known_b, description)
+
+
+def solution_values(case, result):
+    """
+    Check that a result solves a case and agrees with its leak.
+
+    :return: Tuple (canonical solution, problem): the canonical solution is the same for a
+             solution and its mirror, problem is None or a description of what is wrong
+    """
+    if result is None:
+        # The key the leak was generated from always fits it
+        return None, "no solution found"
+    if case.kind == "branch_prune":
+        p, q = bits_to_int(result[0]), bits_to_int(result[1])
+        if p <= 1 or q <= 1 or p * q != case.N:
+            return None, f"p * q != N for p={p}, q={q}"
+        leaked_a, leaked_b = p, q
+        canonical = tuple(sorted((p, q)))
+    else:
+        p, q, dp, dq = (bits_to_int(bits) for bits in result[:4])
+        kp, kq = result[5], result[6]
+        if p <= 1 or q <= 1 or p * q != case.N:
+            return None, f"p * q != N for p={p}, q={q}"
+        if case.e * dp - 1 != kp * (p - 1) or case.e * dq - 1 != kq * (q - 1):
+            return None, f"CRT relations do not hold for dp={dp}, dq={dq}, kp={kp}, kq={kq}"
+        leaked_a, leaked_b = dp, dq
+        canonical = tuple(sorted(((p, dp, kp), (q, dq, kq))))
+    if not (matches_known_bits(leaked_a, case.known_a) and matches_known_bits(leaked_b, case.known_b)):
+        return None, "solution contradicts the known bits"
+    return canonical, None
+
+
+def check_case(case, engines, timings=None):
+    """
+    Run engines on a case and compare them with the reference engine.
+
+    :param case: FuzzCase
+    :param engines: Names of the engines to run; the reference always runs first
+    :param timings: Optional dictionary accumulating the seconds of every engine
+    :return: Dictionary from engine name to the problem found, empty if all engines agree
+    """
+    bit_length = max(len(case.known_a), len(case.known_b))
+    problems = {}
+    reference_solution = None
+    for name in [REFERENCE] + [name for name in engines if name != REFERENCE]:
+        function, max_bits = ENGINES[case.kind][name]
+        if max_bits is not None and bit_length > max_bits:
+            continue
+        start_time = time.perf_counter()
+        try:
+            result = function(*case.arguments())
+        except ENVIRONMENT_ERRORS as error:
+            problems[name] = f"{UNAVAILABLE_PREFIX}{type(error).__name__}: {error}"
+            continue
+        except Exception as error:
+            problems[name] = f"raised {type(error).__name__}: {error}"
+            continue
+        finally:
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + time.perf_counter() - start_time
+        solution, problem = solution_values(case, result)
+        if name == REFERENCE:
+            reference_solution = solution
+        elif problem is None and reference_solution is not None and solution != reference_solution:
+            problem = "solution differs from the reference"
+        if problem is not None:
+            problems[name] = problem
+    return problems
+
+
+def shrink(case, engines):
+    """
+    Reveal as many erased bits as possible while the case still fails, so that the failing
+    pattern keeps only the unknown bits that matter.
+
+    Erased bits are set to their secret value in chunks, halving the chunks when no chunk
+    can be revealed, as in delta debugging.
+
+    :param case: Failing FuzzCase
+    :param engines: Engines to run, usually the failing ones
+    :return: Tuple (smallest failing FuzzCase, its problems)
+    """
+    problems = check_case(case, engines)
+    unknown = case.unknown_positions()
+    chunk_size = max(len(unknown) // 2, 1)
+    while unknown:
+        shrunk = False
+        for start in range(0, len(unknown), chunk_size):
+            chunk = set(unknown[start:start + chunk_size])
+            known_a = [case.secret_a[i] if ("a", i) in chunk else bit for i, bit in enumerate(case.known_a)]
+            known_b = [case.secret_b[i] if ("b", i) in chunk else bit for i, bit in enumerate(case.known_b)]
+            candidate = case.with_known_bits(known_a, known_b)
+            candidate_problems = check_case(candidate, engines)
+            if candidate_problems:
+                case, problems = candidate, candidate_problems
+                unknown = [position for position in unknown if position not in chunk]
+                shrunk = True
+                break
+        if not shrunk:
+            if chunk_size == 1:
+                break
+            chunk_size = max(chunk_size // 2, 1)
+        else:
+            chunk_size = min(chunk_size, max(len(unknown) // 2, 1))
+    return case, problems
+
+
+def fuzz(count, kinds, engines=None, bitsizes=None, rates=None, models=None, e=17, seed=0,
+         max_failures=None, report=print):
+    """
+    Generate count random cases and check every registered engine against the reference.
+
+    :param count: Number of cases
+    :param kinds: Engine kinds to fuzz, "branch_prune" and/or "crt_pruning"
+    :param engines: Names of the engines to check (default: all registered)
+    :param bitsizes: Bit sizes of p and q to draw from
+    :param rates: Reveal rates to draw from
+    :param models: Leak models to draw from (default: all of leak_models)
+    :param e: The public exponent of CRT instances
+    :param seed: Seed of the run; every case gets its own seed, printed with it
+    :param max_failures: Stop after this many failing cases
+    :param report: Function receiving the progress lines
+    :return: Tuple (failures, timings): failures is a list of (shrunk case, problems), timings
+             maps (kind, engine) to the total seconds
+    """
+    bitsizes = bitsizes or DEFAULT_BITSIZES
+    rates = rates or DEFAULT_RATES
+    models = models or list(leak_models.LEAK_MODELS)
+    rng = random.Random(seed)
+    timings = {kind: {} for kind in kinds}
+    failures = []
+    for (kind, name), module in UNAVAILABLE.items():
+        if kind in kinds and (engines is None or name in engines):
+            report(f"SKIP {kind}/{name}: module {module} is not installed")
+    dropped = set()
+    for index in range(count):
+        kind = kinds[index % len(kinds)]
+        case = generate_case(kind, rng.choice(bitsizes), rng.choice(models), rng.choice(rates), rng.getrandbits(32), e)
+        names = [name for name in ENGINES[kind]
+                 if (engines is None or name in engines) and (kind, name) not in dropped]
+        problems = check_case(case, names, timings[kind])
+        for name, problem in list(problems.items()):
+            if name != REFERENCE and problem.startswith(UNAVAILABLE_PREFIX):
+                # Not a bug the leak could reveal: drop the engine instead of shrinking on it
+                dropped.add((kind, name))
+                report(f"SKIP {kind}/{name}: {problem[len(UNAVAILABLE_PREFIX):]}")
+                del problems[name]
+        if problems:
+            failing = [name for name in problems if name != REFERENCE]
+            case, problems = shrink(case, failing)
+            failures.append((case, problems))
+            report(f"FAIL {kind} {json.dumps(case.description)}: "
+                   + "; ".join(f"{name}: {problem}" for name, problem in problems.items()))
+            if max_failures is not None and len(failures) >= max_failures:
+                break
+        if (index + 1) % REPORT_INTERVAL == 0 or index + 1 == count:
+            report(f"{index + 1} cases, {len(failures)} failing | " + speedup_summary(timings))
+    return failures, timings
+
+
+def speedup_summary(timings):
+    """
+    Speedup of every engine over the reference, from the accumulated timings.
+    """
+    parts = []
+    for kind, engine_timings in timings.items():
+        reference_time = engine_timings.get(REFERENCE, 0.0)
+        for name, seconds in engine_timings.items():
+            if name != REFERENCE and seconds > 0:
+                parts.append(f"{kind}/{name} {reference_time / seconds:.2f}x")
+    return ", ".join(parts) or "no timings"
+
+
+def main():
+    import argparse
+    global DEFAULT_PARALLEL_WORKERS
+
+    parser = argparse.ArgumentParser(
+        description='Differential fuzzing: check every registered engine against the reference engines '
+                    'on seeded random instances')
+    parser.add_argument('--count', type=int, default=200, help='Number of generated instances')
+    parser.add_argument('--kinds', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument('--engines', nargs='+', default=None, help='Engines to check (default: all registered)')
+    parser.add_argument('--bitsizes', nargs='+', type=int, default=DEFAULT_BITSIZES, help='Bit sizes of p and q')
+    parser.add_argument('--rates', nargs='+', type=float, default=DEFAULT_RATES, help='Reveal rates')
+    parser.add_argument('--models', nargs='+', choices=list(leak_models.LEAK_MODELS), default=None)
+    parser.add_argument('--e', type=int, default=17, help='Public exponent of the CRT instances')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=DEFAULT_PARALLEL_WORKERS,
+                        help='Worker processes or threads of the parallel engines')
+    parser.add_argument('--max-failures', type=int, default=None, help='Stop after this many failing instances')
+    parser.add_argument('--json', metavar='PATH', default=None, help='Write the shrunk failing instances as JSON')
+    args = parser.parse_args()
+
+    DEFAULT_PARALLEL_WORKERS = args.workers
+    failures, timings = fuzz(args.count, args.kinds, args.engines, args.bitsizes, args.rates, args.models,
+                             args.e, args.seed, args.max_failures)
+
+    print(f"{'kind':<13} {'engine':<10} {'seconds':>9} {'speedup':>8}")
+    for kind, engine_timings in timings.items():
+        reference_time = engine_timings.get(REFERENCE, 0.0)
+        for name, seconds in engine_timings.items():
+            speedup = "-" if name == REFERENCE or not seconds else f"{reference_time / seconds:.2f}x"
+            print(f"{kind:<13} {name:<10} {seconds:>9.3f} {speedup:>8}")
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump([dict(case.to_dict(), problems=problems) for case, problems in failures], json_file, indent=2)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,8 @@ from rsa import generate_prime,generate_keypair
 from rsa import mod_inverse
 from math import ceil, log, gcd
 import random
+import functools
+import arithmetic
 
 
 # Helper functions for crt_pruning
@@ -20,7 +22,7 @@ def find_kq_from_kp(kp, N, e):
     rhs = (kp - 1) % e
 
     # Check if lhs is invertible under modulo e
-    if (gcd(lhs, e) != 1): 
+    if (arithmetic.gcd(lhs, e) != 1): 
         return None
     
     # Calculate the modular inverse of lhs
@@ -79,17 +81,89 @@ def verify_integer_relations(dp_bits, dq_bits, p_bits, q_bits, e, N, kp,kq):
     bol3 = (bits_to_int(p_bits) * bits_to_int(q_bits) == N)
     return bol1 and bol2 and bol3   
 
+# Lifted 2-adic inverses kept by lift_2adic_inverse, bounded for long-lived processes
+# (service.py, main.py --serve-stdin) that see many keys
+LIFTED_INVERSES_CACHE_SIZE = 1024
+
+@functools.lru_cache(maxsize=LIFTED_INVERSES_CACHE_SIZE)
+def lift_2adic_inverse(k, bit_length):
+    """
+    Precompute the 2-adic inverse of k to full width, once per (k, bit_length).
+
+    k is written 2^t * u with u odd, and the inverse of u mod 2^bit_length is lifted with
+    Newton's iteration x <- x * (2 - u * x), which doubles the number of correct bits at each
+    step. The inverse of u mod 2^(i+1) is then the lifted inverse truncated to i+1 bits.
+
+    :param k: The coefficient kp or kq
+    :param bit_length: Width of the lifted inverse in bits
+    :return: Tuple (t, inverse of u mod 2^bit_length); t is bit_length when 2^bit_length divides k
+    """
+    modulus_mask = (1 << bit_length) - 1
+    if k & modulus_mask == 0:
+        result = (bit_length, 0)
+    else:
+        t = (k & -k).bit_length() - 1
+        u = k >> t
+        inverse = u  # u * u = 1 mod 8 for every odd u, so u is its own inverse on 3 bits
+        correct_bits = 3
+        while correct_bits < bit_length:
+            correct_bits *= 2
+            inverse = (inverse * (2 - u * inverse)) & ((1 << correct_bits) - 1)
+        result = (t, inverse & modulus_mask)
+    return result
+
+def solve_2adic(rhs, t, inverse, width):
+    """
+    Solve k * x = rhs mod 2^width for x, where k = 2^t * u and inverse is the 2-adic inverse of u.
+
+    :param rhs: Right-hand side of the congruence
+    :param t: 2-adic valuation of k
+    :param inverse: Inverse of the odd part of k, lifted to at least width bits
+    :param width: Number of bits of the modulus
+    :return: x mod 2^(width - t), the bits of x that the congruence determines, or None if there is no solution
+    """
+    if t >= width:
+        return 0 if rhs & ((1 << width) - 1) == 0 else None
+    if rhs & ((1 << t) - 1):
+        return None
+    return ((rhs >> t) * inverse) & ((1 << (width - t)) - 1)
+
+def congruence_bit_candidates(rhs, t, inverse, low, i):
+    """
+    Find the values of bit i of x allowed by k * x = rhs mod 2^(i+1), the bits of x below i being fixed.
+
+    :param rhs: Right-hand side of the congruence
+    :param t: 2-adic valuation of k
+    :param inverse: Inverse of the odd part of k, lifted to at least i+1 bits
+    :param low: Value of the bits of x below i
+    :param i: The bit position to consider
+    :return: Tuple of the allowed values of bit i, empty if the fixed bits contradict the congruence
+    """
+    solution = solve_2adic(rhs, t, inverse, i + 1)
+    if solution is None:
+        return ()
+    determined = max(i + 1 - t, 0)
+    if (solution ^ low) & ((1 << min(determined, i)) - 1):
+        return ()
+    if determined == i + 1:
+        return ((solution >> i) & 1,)
+    return (0, 1)
+
 def find_p_q_from_dp_dq(dp, dq, kp, kq, e, i):
     """
     Calculate the bits of p and q for the given bit position i.
 
+    The 2-adic inverses of kp and kq are lifted once per (kp, kq, bit_length), so each bit
+    position only costs a multiplication and a mask. When kp (resp. kq) has 2-adic valuation
+    t, only the lowest i+1-t bits of p (resp. q) are determined and the higher ones are left at 0.
+
     :param dp: The value of dp as a list of  bits
     :param dq: The value of dq as a list of bits
     :param kp: The coefficient kp
     :param kq: The coefficient kq
     :param e: The public exponent
     :param i: The bit position to consider
-    :return: The bits of p and q for the given bit posnghjkhgjgition and derived from dp and dq or None if no solution exists
+    :return: The bits of p and q for the given bit position and derived from dp and dq or None if no solution exists
     """
   
     bit_length = len(dp)
@@ -108,16 +182,15 @@ def find_p_q_from_dp_dq(dp, dq, kp, kq, e, i):
     rhs_p = ((e * dp) - 1 + kp) 
     rhs_q = ((e * dq) - 1 + kq) 
 
-    if gcd(kp, 1 << (i + 1)) != 1 or gcd(kq, 1 << (i + 1)) != 1:
-        return (None, None)
-    
-    # Find the inverses of kp and kq modulo 2^i
-    kp_inverse = mod_inverse(kp, 1 << (i + 1))
-    kq_inverse = mod_inverse(kq, 1 << (i + 1))
+    # Inverses of the odd parts of kp and kq modulo 2^bit_length, truncated to i+1 bits below
+    t_p, kp_inverse = lift_2adic_inverse(kp, bit_length)
+    t_q, kq_inverse = lift_2adic_inverse(kq, bit_length)
 
     # Calculate the bits of p and q
-    p_bits = (kp_inverse * rhs_p) % (1 << (i + 1))
-    q_bits = (kq_inverse * rhs_q) % (1 << (i + 1))
+    p_bits = solve_2adic(rhs_p, t_p, kp_inverse, i + 1)
+    q_bits = solve_2adic(rhs_q, t_q, kq_inverse, i + 1)
+    if p_bits is None or q_bits is None:
+        return (None, None)
 
     p_bits = int_to_bits_lsb_start(p_bits,bit_length)
     q_bits = int_to_bits_lsb_start(q_bits,bit_length)
@@ -188,6 +261,36 @@ def padding_input_lsb_end(known_bits_p, known_bits_q):
     return known_bits_p, known_bits_q
 
 
+def symmetric_suffixes(known_bits_a, known_bits_b):
+    """
+    Find the levels from which two leaks can no longer tell their values apart.
+
+    symmetric[i] is True when the known bits of a and b agree at every level from i up, so
+    that swapping two candidates equal below level i gives a pair that fits the leak as well.
+
+    :param known_bits_a: Known bits of the first value (lsb first, -1 for unknown)
+    :param known_bits_b: Known bits of the second value (lsb first, -1 for unknown)
+    :return: List of bit_length + 1 booleans
+    """
+    known_bits_a, known_bits_b = padding_input_lsb_end(known_bits_a, known_bits_b)
+    symmetric = [True] * (len(known_bits_a) + 1)
+    for i in range(len(known_bits_a) - 1, -1, -1):
+        symmetric[i] = symmetric[i + 1] and known_bits_a[i] == known_bits_b[i]
+    return symmetric
+
+
+def known_suffix_start(known_bits):
+    """
+    Find the level from which every bit of a leak is known.
+
+    :param known_bits: Known bits (lsb first, -1 for unknown)
+    :return: Smallest level i such that no bit from i up is unknown (len(known_bits) if the top bit is unknown)
+    """
+    start = len(known_bits)
+    while start > 0 and known_bits[start - 1] != -1:
+        start -= 1
+    return start
+
 
 def is_valid(p_bits, q_bits, i, N):
     """
@@ -205,6 +308,18 @@ def is_valid(p_bits, q_bits, i, N):
     return (p_bits * q_bits) % (1 << (i + 1)) == N % (1 << (i + 1))
 
 
+def verify_factors(p_bits, q_bits, N):
+    """
+    Check that the bits of p and q at a leaf of the tree are a factorization of N.
+
+    :param p_bits: Bits of p
+    :param q_bits: Bits of q
+    :param N: Public key to be factorized
+    :return: True if p * q = N, False otherwise
+    """
+    return bits_to_int(p_bits) * bits_to_int(q_bits) == N
+
+
 def set_bit(bits, bit_pos, value):
     """
     Set the bit at the specified position to the given value.
@@ -268,16 +383,22 @@ def int_to_bits_lsb_end(value, length=-1):
 
 def print_tree(node, level=0):
     """
-    Recursively prints the tree structure given a root node.
+    Prints the tree structure given a root node, in depth-first order.
+
+    The tree is walked with an explicit stack, so deep trees do not hit the recursion limit.
+    Use tree_export.TreeExporter to stream large trees to a file instead.
     
     :param node: The root node of the tree.
-    :param level: The current level in the tree (used for indentation).
+    :param level: The level of the root node (used for indentation).
     """
-    if node is not None:
-        indent = "  " * level
-        print(f"{indent}{repr(node)}")
-        for child in node.children:
-            print_tree(child, level + 1)
+    stack = [(node, level)]
+    while stack:
+        node, level = stack.pop()
+        if node is not None:
+            indent = "  " * level
+            print(f"{indent}{repr(node)}")
+            for child in reversed(node.children):
+                stack.append((child, level + 1))
 
     
     
@@ -337,7 +458,7 @@ def example_generator_crt_pruning(reveal_rate, bit_size, e):
 
     phi = (p - 1) * (q - 1)
     
-    while(e > (phi - 1) or gcd(e, phi) != 1):
+    while(e > (phi - 1) or arithmetic.gcd(e, phi) != 1):
         N, p, q, p_bits, q_bits, p_erased, q_erased = example_generator(reveal_rate,bit_size)
         phi = (p - 1) * (q - 1)
 
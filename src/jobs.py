@@ -0,0 +1,53 @@
+from helpers import bits_to_int
+from result_cache import cached_branch_and_prune, cached_branch_and_prune_crt
+
+
+# Job format shared by main.py (--job, --serve-stdin) and the recovery service (service.py)
+
+
+def parse_known_bits(value):
+    """
+    Read known bits given as a list or as a string such as "1?01" (msb first, ? or x for unknown).
+
+    :param value: List of bits (-1 for unknown) or string
+    :return: List of bits, -1 for unknown
+    """
+    if isinstance(value, str):
+        bits = [-1 if char in "?xX" else int(char) for char in value if not char.isspace()]
+    else:
+        bits = [int(bit) for bit in value]
+    for bit in bits:
+        if bit not in (-1, 0, 1):
+            raise ValueError(f"invalid known bit: {bit}")
+    return bits
+
+
+def solve_job(request, cache=None, workers=None, exporter=None, monitor=None):
+    """
+    Solve a single job given as a dictionary in the format of the service protocol (see service.py).
+
+    :param request: Job with "engine", "N" and the known bits, plus "e" for crt_pruning
+    :param cache: Optional ResultCache
+    :param workers: Optional number of search processes
+    :param exporter: Optional TreeExporter
+    :param monitor: Optional MemoryMonitor
+    :return: Dictionary with the recovered values, or None if no solution exists
+    """
+    engine = request.get("engine", "branch_prune")
+    N = int(request["N"])
+    if engine == "crt_pruning":
+        e = int(request["e"])
+        result = cached_branch_and_prune_crt(cache, N, e, parse_known_bits(request["known_bits_dp"]),
+                                             parse_known_bits(request["known_bits_dq"]), exporter, monitor, workers)
+        if result is None:
+            return None
+        p, q, dp, dq, root_node, kp, kq = result
+        return {"p": bits_to_int(p), "q": bits_to_int(q), "dp": bits_to_int(dp), "dq": bits_to_int(dq),
+                "kp": kp, "kq": kq}
+    if engine != "branch_prune":
+        raise ValueError(f"unknown engine: {engine}")
+    result = cached_branch_and_prune(cache, N, parse_known_bits(request["known_bits_p"]),
+                                     parse_known_bits(request["known_bits_q"]), exporter, monitor, workers)
+    if result is None:
+        return None
+    return {"p": bits_to_int(result[0]), "q": bits_to_int(result[1])}
@@ -0,0 +1,254 @@
+import mmap
+from helpers import *
+
+
+# RSAPrivateKey ::= SEQUENCE { version INTEGER (0), modulus INTEGER, ... }: the version
+# followed by the tag of the modulus is a short, stable anchor for the search
+SIGNATURE = b"\x02\x01\x00\x02"
+
+# Bytes scanned per window, and how far windows overlap so that no signature is cut in two
+CHUNK_SIZE = 64 * 1024 * 1024
+CHUNK_OVERLAP = 16
+
+# Largest modulus accepted, in bytes (8192 bits): longer length fields in a false match of
+# the signature are rejected before anything is read
+MAX_MODULUS_BYTES = 1024
+
+# Bits decay towards the ground state of the memory: set ground_state to the value decayed bits take
+GROUND_STATE_NONE = None
+
+
+def read_der_length(view, pos):
+    """
+    Read a DER length field.
+
+    :param view: Memoryview over the dump
+    :param pos: Offset of the length field
+    :return: Tuple (length, offset of the content) or (None, pos) if the field is malformed
+    """
+    if pos >= len(view):
+        return None, pos
+    first = view[pos]
+    if first < 0x80:
+        return first, pos + 1
+    size = first & 0x7F
+    if size == 0 or size > 4 or pos + 1 + size > len(view):
+        return None, pos
+    return int.from_bytes(view[pos + 1:pos + 1 + size], 'big'), pos + 1 + size
+
+
+def der_header_size(length):
+    """
+    Size of the tag and length fields of a DER INTEGER whose content is length bytes long.
+    """
+    return 2 if length < 0x80 else 3 if length < 0x100 else 4
+
+
+def read_der_integer(view, pos, expected, trust_length=True):
+    """
+    Read a DER INTEGER.
+
+    Length fields may have decayed like any other byte, so when trust_length is False the
+    canonical layout is assumed instead: expected content bytes, plus the leading zero byte
+    DER adds when the high bit of the value is set.
+
+    :param view: Memoryview over the dump
+    :param pos: Offset of the INTEGER tag
+    :param expected: Expected length in bytes of the value
+    :param trust_length: Whether to read the length from the dump
+    :return: Tuple (content as a memoryview, offset of the next field) or (None, pos) if it cannot be read
+    """
+    if trust_length:
+        if pos >= len(view) or view[pos] != 0x02:
+            return None, pos
+        length, start = read_der_length(view, pos + 1)
+        # No field of a key is longer than its modulus
+        if length is None or length > MAX_MODULUS_BYTES + 1:
+            return None, pos
+    else:
+        start = pos + der_header_size(expected + 1)
+        length = expected + 1
+        if start >= len(view) or view[start] != 0x00:
+            start = pos + der_header_size(expected)
+            length = expected
+    if start + length > len(view):
+        return None, pos
+    return view[start:start + length], start + length
+
+
+def bytes_to_known_bits(content, bit_length, ground_state=GROUND_STATE_NONE):
+    """
+    Convert the bytes of a possibly decayed integer into a list of known bits.
+
+    A bit that differs from the ground state cannot have decayed and is known; a bit equal
+    to the ground state may have decayed and is marked unknown (-1).
+
+    :param content: Big-endian bytes of the integer
+    :param bit_length: Length of the returned list
+    :param ground_state: Value decayed bits take (0 or 1), or None if the dump has not decayed
+    :return: List of known bits, msb first
+    """
+    value = int.from_bytes(content, 'big') & ((1 << bit_length) - 1)
+    bits = int_to_bits_lsb_end(value, bit_length)
+    if ground_state is None:
+        return bits
+    return [bit if bit != ground_state else -1 for bit in bits]
+
+
+def parse_private_key(view, offset, e=65537, ground_state=GROUND_STATE_NONE, moduli=None):
+    """
+    Parse a candidate RSAPrivateKey found at offset and turn it into a recovery job.
+
+    :param view: Memoryview over the dump
+    :param offset: Offset of the version INTEGER
+    :param e: The public exponent of the key, used to skip its field when lengths have decayed
+    :param ground_state: Value decayed bits take (0 or 1), or None if the dump has not decayed
+    :param moduli: Optional set of known public moduli; the decayed modulus is matched against them.
+                   Required when ground_state is set: a decayed modulus cannot be the target of a recovery
+    :return: Job dictionary, or None if the region does not look like a private key
+    """
+    trust_length = ground_state is None
+    if trust_length:
+        length, start = read_der_length(view, offset + 4)
+        # One leading zero byte is added when the top bit of the modulus is set
+        if length is None or length < 3 or length > MAX_MODULUS_BYTES + 1 or start + length > len(view):
+            return None
+        N = int.from_bytes(view[start:start + length], 'big')
+        if N.bit_length() < 16 or N % 2 == 0:
+            return None
+        if moduli is not None and N not in moduli:
+            return None
+        pos = start + length
+    else:
+        # The length of the modulus may have decayed too, so each known modulus is tried with
+        # the canonical layout of its own size. Decay only moves bits towards the ground state,
+        # so the true modulus covers the decayed one
+        if moduli is None:
+            return None
+        candidates = []
+        for M in moduli:
+            content, next_pos = read_der_integer(view, offset + 3, (M.bit_length() + 7) // 8, False)
+            if content is None:
+                continue
+            decayed = int.from_bytes(content, 'big')
+            if ground_state == 0 and M & decayed == decayed or ground_state == 1 and M | decayed == decayed:
+                candidates.append((M, next_pos))
+        if len(candidates) != 1:
+            return None
+        N, pos = candidates[0]
+
+    modulus_bytes = (N.bit_length() + 7) // 8
+    half_bytes = (modulus_bytes + 1) // 2
+    half_bits = (N.bit_length() + 1) // 2
+
+    e_bytes, pos = read_der_integer(view, pos, (e.bit_length() + 7) // 8, trust_length)
+    if e_bytes is None or trust_length and int.from_bytes(e_bytes, 'big') != e:
+        return None
+
+    values = []
+    for expected in (modulus_bytes, half_bytes, half_bytes, half_bytes, half_bytes):
+        content, pos = read_der_integer(view, pos, expected, trust_length)
+        if content is None:
+            return None
+        values.append(content)
+    d_bytes, p_bytes, q_bytes, dp_bytes, dq_bytes = values
+
+    N_bits = N.bit_length()
+    return {
+        "offset": offset,
+        "N": N,
+        "e": e,
+        "known_bits_p": bytes_to_known_bits(p_bytes, half_bits, ground_state),
+        "known_bits_q": bytes_to_known_bits(q_bytes, half_bits, ground_state),
+        # The CRT engine works on dp and dq padded with zeros to the size of N
+        "known_bits_dp": padding_input(bytes_to_known_bits(dp_bytes, half_bits, ground_state), N_bits),
+        "known_bits_dq": padding_input(bytes_to_known_bits(dq_bytes, half_bits, ground_state), N_bits),
+    }
+
+
+def scan_dump(path, e=65537, ground_state=GROUND_STATE_NONE, moduli=None, chunk_size=CHUNK_SIZE):
+    """
+    Memory-map a dump and stream the RSA private keys found in it as recovery jobs.
+
+    The dump is searched window by window directly in the mapping, so no copy of it is made
+    and pages already scanned can be dropped by the OS whatever the size of the file.
+
+    :param path: Path of the dump file
+    :param e: The public exponent of the keys
+    :param ground_state: Value decayed bits take (0 or 1), or None if the dump has not decayed
+    :param moduli: Optional set of known public moduli to match the keys against, required when
+                   ground_state is set
+    :param chunk_size: Bytes searched per window
+    :return: Generator of job dictionaries (see parse_private_key)
+    """
+    with open(path, "rb") as dump:
+        if dump.seek(0, 2) == 0:
+            return
+        with mmap.mmap(dump.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            view = memoryview(mapping)
+            try:
+                size = len(mapping)
+                for chunk_start in range(0, size, chunk_size):
+                    chunk_end = min(chunk_start + chunk_size + CHUNK_OVERLAP, size)
+                    offset = mapping.find(SIGNATURE, chunk_start, chunk_end)
+                    # Hits in the overlap belong to the next window
+                    while offset != -1 and offset < chunk_start + chunk_size:
+                        job = parse_private_key(view, offset, e, ground_state, moduli)
+                        if job is not None:
+                            yield job
+                        offset = mapping.find(SIGNATURE, offset + 1, chunk_end)
+                    if hasattr(mmap, "MADV_DONTNEED"):
+                        page_start = chunk_start - chunk_start % mmap.PAGESIZE
+                        mapping.madvise(mmap.MADV_DONTNEED, page_start, chunk_end - page_start)
+            finally:
+                view.release()
+
+
+def solve_jobs(jobs, engine="branch_prune"):
+    """
+    Run the recovery engines on a stream of jobs.
+
+    :param jobs: Iterable of job dictionaries, e.g. from scan_dump
+    :param engine: "branch_prune" to search on the bits of p and q, "crt_pruning" for dp and dq
+    :return: Generator of tuples (job, result) where result is the engine's output
+    """
+    from branch_prune import branch_and_prune
+    from crt_pruning import branch_and_prune_crt
+
+    for job in jobs:
+        if engine == "crt_pruning":
+            result = branch_and_prune_crt(job["N"], job["e"], job["known_bits_dp"], job["known_bits_dq"])
+        else:
+            result = branch_and_prune(job["N"], job["known_bits_p"], job["known_bits_q"])
+        yield job, result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Scan a memory dump for RSA private keys and recover them')
+    parser.add_argument('path', help='Path of the dump file')
+    parser.add_argument('--ground-state', type=int, choices=[0, 1], default=None,
+                        help='Value decayed bits take (default: the dump has not decayed)')
+    parser.add_argument('--engine', choices=['branch_prune', 'crt_pruning'], default='branch_prune',
+                        help='Engine used on each key found')
+    parser.add_argument('--e', type=int, default=65537, help='Public exponent of the keys')
+    parser.add_argument('--moduli', default=None,
+                        help='File of known public moduli, one per line (decimal, or hex with 0x); '
+                             'required with --ground-state, since a decayed modulus cannot be factored')
+    args = parser.parse_args()
+
+    moduli = None
+    if args.moduli is not None:
+        with open(args.moduli) as moduli_file:
+            moduli = {int(line, 0) for line in moduli_file if line.strip()}
+    if args.ground_state is not None and moduli is None:
+        parser.error('--ground-state needs --moduli')
+
+    for job, result in solve_jobs(scan_dump(args.path, args.e, args.ground_state, moduli), args.engine):
+        print(f"Key at offset {job['offset']}, N = {job['N']}")
+        if result is None:
+            print("No solution found")
+        else:
+            print(f"Recovered p: {bits_to_int(result[0])}")
+            print(f"Recovered q: {bits_to_int(result[1])}")
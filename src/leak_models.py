@@ -0,0 +1,285 @@
+import json
+import random
+import statistics
+import time
+import arithmetic
+import branch_prune
+import crt_pruning
+from helpers import *
+from regression import seeded_prime
+
+
+# Heninger-Shacham bounds on the reveal rate, by the values the leak covers
+HS_BOUNDS = {
+    "p, q, d, dp, dq": 0.27,
+    "p, q, d": 0.42,
+    "p, q": 2 - 2 ** 0.5,
+}
+
+# Reveal rate above which the engines are expected to run in polynomial time. branch_prune
+# sees leaks of p and q, so the Heninger-Shacham bound for (p, q) applies. crt_pruning sees
+# leaks of dp and dq only and checks 4 bits per level against 3 congruences, so a wrong node
+# has 2^(1 - 2 * rate) children on average, which drops below one at rate 0.5.
+THEORETICAL_THRESHOLDS = {
+    "branch_prune": HS_BOUNDS["p, q"],
+    "crt_pruning": 0.5,
+}
+
+DEFAULT_KEY_SIZES = [256, 512, 1024, 2048]
+DEFAULT_RATES = [0.3, 0.4, 0.5, 0.55, 0.6, 0.65, 0.7, 0.8]
+DEFAULT_MAX_NODES = 5000
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class NodeBudget:
+    """
+    Counts the nodes expanded by an engine and stops the search after max_nodes of them.
+
+    Passed to the engines as their monitor, which calls step() once per node.
+    """
+
+    def __init__(self, max_nodes=None):
+        self.max_nodes = max_nodes
+        self.nodes = 0
+
+    def step(self, stack_size):
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise BudgetExceeded(f"more than {self.max_nodes} nodes")
+
+
+def erase_iid(bits, rate, rng):
+    """
+    Reveal every bit independently with probability rate (the model of helpers.erase_bits).
+
+    :param bits: List of bits (msb first)
+    :param rate: Expected fraction of revealed bits
+    :param rng: random.Random instance
+    :return: List of bits with the erased bits set to -1
+    """
+    return [bit if rng.random() < rate else -1 for bit in bits]
+
+
+def erase_bursty(bits, rate, rng, burst_length=8):
+    """
+    Erase bits in bursts: a two-state Markov chain whose erased runs are burst_length bits
+    long on average and whose revealed runs are long enough to keep the reveal rate.
+    """
+    if rate <= 0.0 or rate >= 1.0:
+        return erase_iid(bits, rate, rng)
+    leave_erased = 1.0 / burst_length
+    leave_revealed = leave_erased * (1 - rate) / rate
+    revealed = rng.random() < rate
+    erased = []
+    for bit in bits:
+        erased.append(bit if revealed else -1)
+        if rng.random() < (leave_revealed if revealed else leave_erased):
+            revealed = not revealed
+    return erased
+
+
+def erase_msb_biased(bits, rate, rng, bias=0.8):
+    """
+    Reveal the high bits more often than the low bits. The reveal probability goes linearly
+    from rate + bias * spread at the msb to rate - bias * spread at the lsb, with
+    spread = min(rate, 1 - rate), so the overall reveal rate is kept.
+    """
+    spread = min(rate, 1 - rate)
+    last = max(len(bits) - 1, 1)
+    return [bit if rng.random() < rate + bias * spread * (1 - 2 * i / last) else -1 for i, bit in enumerate(bits)]
+
+
+def erase_periodic(bits, rate, rng, word_size=64):
+    """
+    Reveal or erase whole words of word_size bits, aligned on the lsb as in memory.
+    """
+    erased = []
+    offset = len(bits) % word_size
+    word_revealed = rng.random() < rate
+    for i, bit in enumerate(bits):
+        if i > 0 and (i - offset) % word_size == 0:
+            word_revealed = rng.random() < rate
+        erased.append(bit if word_revealed else -1)
+    return erased
+
+
+def leak_pair(model, bits_a, bits_b, rate, rng, skew=0.5):
+    """
+    Erase the bits of the two leaked values (p and q, or dp and dq) with a leak model.
+
+    The asymmetric model reveals the first value with rate * (1 + skew) and the second one
+    with rate * (1 - skew), capped to [0, 1]; the other models apply to both values alike.
+
+    :param model: Name of the model, one of LEAK_MODELS
+    :param bits_a: Bits of the first value (msb first)
+    :param bits_b: Bits of the second value (msb first)
+    :param rate: Expected fraction of revealed bits
+    :param rng: random.Random instance
+    :param skew: Relative difference of the reveal rates in the asymmetric model
+    :return: Tuple of the two erased bit lists
+    """
+    if model == "asymmetric":
+        return (erase_iid(bits_a, min(1.0, rate * (1 + skew)), rng),
+                erase_iid(bits_b, max(0.0, rate * (1 - skew)), rng))
+    erase = LEAK_MODELS[model]
+    return erase(bits_a, rate, rng), erase(bits_b, rate, rng)
+
+
+LEAK_MODELS = {
+    "iid": erase_iid,
+    "bursty": erase_bursty,
+    "msb_biased": erase_msb_biased,
+    "periodic": erase_periodic,
+    "asymmetric": erase_iid,
+}
+
+
+def leak_instance(engine, model, rate, key_size, rng, e=17):
+    """
+    Generate a key of key_size bits and leak it to an engine through a leak model.
+
+    :param engine: "branch_prune" or "crt_pruning"
+    :param model: Name of the leak model
+    :param rate: Expected fraction of revealed bits
+    :param key_size: Bit size of N
+    :param rng: random.Random instance
+    :param e: The public exponent of CRT instances
+    :return: Tuple (N, arguments of the engine)
+    """
+    while True:
+        p = seeded_prime(rng, key_size // 2, exact=True)
+        q = seeded_prime(rng, key_size // 2, exact=True)
+        phi = (p - 1) * (q - 1)
+        if p != q and (engine == "branch_prune" or arithmetic.gcd(e, phi) == 1):
+            break
+    N = p * q
+
+    if engine == "branch_prune":
+        p_bits, q_bits = padding_two_inputs(int_to_bits_lsb_end(p), int_to_bits_lsb_end(q))
+        p_erased, q_erased = leak_pair(model, p_bits, q_bits, rate, rng)
+        return N, (N, p_erased, q_erased)
+
+    d = mod_inverse(e, phi)
+    N_bits_size = ceil(log(N, 2))
+    dp_bits = padding_input(int_to_bits_lsb_end(d % (p - 1)), N_bits_size)
+    dq_bits = padding_input(int_to_bits_lsb_end(d % (q - 1)), N_bits_size)
+    dp_erased, dq_erased = leak_pair(model, dp_bits, dq_bits, rate, rng)
+    return N, (N, e, dp_erased, dq_erased)
+
+
+def run_trial(engine, N, arguments, max_nodes):
+    """
+    Run an engine on a leak under a node budget.
+
+    :return: Tuple (solved, expanded nodes, seconds)
+    """
+    budget = NodeBudget(max_nodes)
+    start_time = time.perf_counter()
+    try:
+        if engine == "branch_prune":
+            result = branch_prune.branch_and_prune(*arguments, monitor=budget)
+        else:
+            result = crt_pruning.branch_and_prune_crt(*arguments, monitor=budget)
+    except BudgetExceeded:
+        result = None
+    elapsed = time.perf_counter() - start_time
+    solved = result is not None and bits_to_int(result[0]) * bits_to_int(result[1]) == N
+    return solved, budget.nodes, elapsed
+
+
+def empirical_threshold(points, target=0.5):
+    """
+    Smallest reveal rate at which the success probability reaches target, interpolated
+    linearly between the measured rates.
+
+    :param points: List of (rate, success probability), sorted by rate
+    :return: The threshold, or None if the target is never reached
+    """
+    previous = None
+    for rate, success in points:
+        if success >= target:
+            if previous is None or previous[1] >= success:
+                return rate
+            previous_rate, previous_success = previous
+            return previous_rate + (rate - previous_rate) * (target - previous_success) / (success - previous_success)
+        previous = (rate, success)
+    return None
+
+
+def scaling_study(models, engines, key_sizes, rates, trials, max_nodes=DEFAULT_MAX_NODES, e=17, seed=0, report=print):
+    """
+    Measure success probability, median expanded nodes and median runtime of the engines
+    for every leak model, key size and reveal rate.
+
+    :return: Tuple (rows, thresholds). Each row is a dictionary with the model, engine,
+             key size, rate, success probability, median nodes and median seconds. thresholds
+             maps (model, engine, key size) to the empirical threshold
+    """
+    rng = random.Random(seed)
+    rows = []
+    thresholds = {}
+    for model in models:
+        for engine in engines:
+            for key_size in key_sizes:
+                points = []
+                for rate in rates:
+                    outcomes = [run_trial(engine, *leak_instance(engine, model, rate, key_size, rng, e), max_nodes)
+                                for _ in range(trials)]
+                    success = sum(solved for solved, _, _ in outcomes) / trials
+                    row = {
+                        "model": model, "engine": engine, "key_size": key_size, "rate": rate,
+                        "success": success,
+                        "median_nodes": statistics.median(nodes for _, nodes, _ in outcomes),
+                        "median_seconds": statistics.median(seconds for _, _, seconds in outcomes),
+                    }
+                    rows.append(row)
+                    points.append((rate, success))
+                    report(f"{model:<11} {engine:<13} {key_size:>5} {rate:>5.2f} {success:>8.0%} "
+                        f"{row['median_nodes']:>10.0f} {row['median_seconds']:>9.3f}")
+                thresholds[(model, engine, key_size)] = empirical_threshold(points)
+    return rows, thresholds
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Sweep leak models, reveal rates and key sizes, and compare the empirical success '
+                    'thresholds of the engines with the theoretical ones')
+    parser.add_argument('--models', nargs='+', default=list(LEAK_MODELS), choices=list(LEAK_MODELS))
+    parser.add_argument('--engines', nargs='+', default=["branch_prune", "crt_pruning"],
+                        choices=["branch_prune", "crt_pruning"])
+    parser.add_argument('--key-sizes', nargs='+', type=int, default=DEFAULT_KEY_SIZES, help='Bit sizes of N')
+    parser.add_argument('--rates', nargs='+', type=float, default=DEFAULT_RATES, help='Reveal rates')
+    parser.add_argument('--trials', type=int, default=5, help='Keys per (model, engine, key size, rate)')
+    parser.add_argument('--max-nodes', type=int, default=DEFAULT_MAX_NODES,
+                        help='Node budget of a trial; trials over budget count as failures')
+    parser.add_argument('--e', type=int, default=17, help='Public exponent of the CRT instances')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='PATH', default=None, help='Also write the rows and thresholds as JSON')
+    args = parser.parse_args()
+
+    print(f"{'model':<11} {'engine':<13} {'bits':>5} {'rate':>5} {'success':>8} {'nodes':>10} {'seconds':>9}")
+    rows, thresholds = scaling_study(args.models, args.engines, sorted(args.key_sizes), sorted(args.rates),
+                                     args.trials, args.max_nodes, args.e, args.seed)
+
+    print()
+    print("Heninger-Shacham bounds: " + ", ".join(f"{bound:.2f} ({values})" for values, bound in HS_BOUNDS.items()))
+    print(f"{'model':<11} {'engine':<13} {'bits':>5} {'empirical':>10} {'theory':>7}")
+    for (model, engine, key_size), threshold in thresholds.items():
+        empirical = "-" if threshold is None else f"{threshold:.2f}"
+        print(f"{model:<11} {engine:<13} {key_size:>5} {empirical:>10} {THEORETICAL_THRESHOLDS[engine]:>7.2f}")
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump({"rows": rows,
+                       "thresholds": [{"model": model, "engine": engine, "key_size": key_size, "threshold": threshold}
+                                      for (model, engine, key_size), threshold in thresholds.items()]},
+                      json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
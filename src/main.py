@@ -1,21 +1,58 @@
 import argparse
-from performance_test import performance_test
-from crt_pruning import branch_and_prune_crt
-from branch_prune import branch_and_prune
+import contextlib
+import json
+import sys
 from helpers import print_tree, example_generator, example_generator_crt_pruning, bits_to_int
+from jobs import parse_known_bits, solve_job
+from result_cache import ResultCache, DEFAULT_CACHE_PATH, cached_branch_and_prune, cached_branch_and_prune_crt
 
-def main():
-    # Define and parse command-line arguments
-    parser = argparse.ArgumentParser(description='RSA CRT Pruning Algorithm')
-    parser.add_argument('--test', action='store_true', help='Run performance tests')
-    parser.add_argument('--revealrate', type=float, default=0.5, help='Bit reveal rate for testing')
-    parser.add_argument('--bitsize', type=int, default=10, help='Bit size for RSA components')
-    parser.add_argument('--e', type=int, default=17, help='Public exponent for RSA')
-    parser.add_argument('--print_tree', action='store_true', help='Print the tree structure of the solutions')
-    args = parser.parse_args()
+# Plotting, profiling, tree export and memory accounting are imported when their options are used
 
+
+def answer(request, cache, workers, exporter, monitor):
+    """
+    Solve a job and build the JSON line answering it: {"id", "result"} or {"id", "error"}.
+    """
+    job_id = request.get("id") if isinstance(request, dict) else None
+    try:
+        return json.dumps({"id": job_id, "result": solve_job(request, cache, workers, exporter, monitor)})
+    except Exception as error:
+        # A bad job, or one going over --memory-limit, must not stop the other jobs
+        return json.dumps({"id": job_id, "error": f"{type(error).__name__}: {error}"})
+
+
+def serve_stdin(cache, workers=None, exporter=None, monitor=None, stdin=sys.stdin, stdout=sys.stdout):
+    """
+    Read one JSON job per line from stdin and write one JSON answer per line to stdout, in
+    a single warm process, until stdin is closed.
+    """
+    for line in stdin:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError:
+            stdout.write(json.dumps({"id": None, "error": "invalid JSON"}) + "\n")
+        else:
+            stdout.write(answer(request, cache, workers, exporter, monitor) + "\n")
+        stdout.flush()
+
+
+def load_job(value):
+    """
+    Read the job of --job: a JSON object, or @PATH for a file holding one.
+    """
+    if value.startswith("@"):
+        with open(value[1:]) as job_file:
+            return json.load(job_file)
+    return json.loads(value)
+
+def run(args, cache, exporter=None, monitor=None):
     if args.test:
-        performance_test(args.bitsize, args.e)
+        from performance_test import compare_algorithms
+        ceiling = None if args.memory_limit is None else int(args.memory_limit * 2**20)
+        compare_algorithms(args.bitsize, args.e, memory=args.memory or args.memory_trace, ceiling=ceiling,
+                           trace=args.memory_trace)
     else:
         # Algorithm 1: branch_prune with textbook example
         print("Algorithm 1: Branch and Prune with Textbook Example")
@@ -25,7 +62,7 @@ def main():
         known_bits_q = [-1, 1, -1, 0, -1]
 
         # Find the factors p and q
-        result = branch_and_prune(N, known_bits_p, known_bits_q)
+        result = cached_branch_and_prune(cache, N, known_bits_p, known_bits_q, exporter, monitor, args.workers)
 
         if result is None:
             print("No solution found")
@@ -60,7 +97,7 @@ def main():
         print(f"q_erased: {q_erased}")
 
         # Find the factors p and q
-        result = branch_and_prune(N, p_erased, q_erased)
+        result = cached_branch_and_prune(cache, N, p_erased, q_erased, exporter, monitor, args.workers)
 
         if result is None:
             print("No solution found")
@@ -80,7 +117,7 @@ def main():
         known_bits_dp = [-1, 0, -1, -1, 1]
         known_bits_dq = [-1, -1, -1, 0, -1]
 
-        result = branch_and_prune_crt(N, e, known_bits_dp, known_bits_dq)
+        result = cached_branch_and_prune_crt(cache, N, e, known_bits_dp, known_bits_dq, exporter, monitor, args.workers)
 
         if result is None:
             print("No solution found")
@@ -137,7 +174,7 @@ def main():
 
         # Attempt to find the factors p and q using the branch and prune algorithm
         print("Finding factors p and q using branch and prune algorithm...")
-        result = branch_and_prune_crt(N, e, dp_erased, dq_erased)
+        result = cached_branch_and_prune_crt(cache, N, e, dp_erased, dq_erased, exporter, monitor, args.workers)
 
         if result is None:
             print("No solution found.")
@@ -164,5 +201,86 @@ def main():
             print(f"Recovered kp: {kp}")
             print(f"Recovered kq: {kq}")
 
+def main():
+    # Define and parse command-line arguments
+    parser = argparse.ArgumentParser(description='RSA CRT Pruning Algorithm')
+    parser.add_argument('--test', action='store_true', help='Run performance tests')
+    parser.add_argument('--revealrate', type=float, default=0.5, help='Bit reveal rate for testing')
+    parser.add_argument('--bitsize', type=int, default=10, help='Bit size for RSA components')
+    parser.add_argument('--e', type=int, default=17, help='Public exponent for RSA')
+    parser.add_argument('--print_tree', action='store_true', help='Print the tree structure of the solutions')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the result cache')
+    parser.add_argument('--cache-path', default=DEFAULT_CACHE_PATH, help='Path of the SQLite result cache')
+    parser.add_argument('--profile', metavar='PATH', default=None,
+                        help='Profile the run: write the pstats dump to PATH and the sorted report to PATH.txt. '
+                             'With --workers, only the main process and worker threads are profiled, '
+                             'not worker processes')
+    parser.add_argument('--export-tree', metavar='PATH', default=None,
+                        help='Stream the explored trees to PATH as JSON lines, or as Graphviz DOT if PATH ends in .dot')
+    parser.add_argument('--export-depth', type=int, default=None, help='Only export nodes up to this depth')
+    parser.add_argument('--export-sample', type=float, default=1.0, help='Fraction of subtrees to export')
+    parser.add_argument('--memory', action='store_true',
+                        help='Report nodes created, largest tree, peak stack size, bytes per node and peak RSS '
+                             'of the searches')
+    parser.add_argument('--memory-trace', action='store_true',
+                        help='Also trace allocations with tracemalloc for --memory and --memory-limit '
+                             '(slows the search down several times)')
+    parser.add_argument('--memory-limit', type=float, default=None, metavar='MB',
+                        help='Abort a search once it uses more than MB megabytes')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Search each key with this many work-stealing processes')
+    parser.add_argument('--job', metavar='JSON', default=None,
+                        help='Only solve this job (a JSON object as in the service protocol, or @PATH) and print the '
+                             'result as JSON, without the demos')
+    parser.add_argument('--serve-stdin', action='store_true',
+                        help='Read JSON jobs line by line from stdin and answer each with a JSON line on stdout')
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else ResultCache(args.cache_path)
+    exporter = None
+    if args.export_tree:
+        from tree_export import TreeExporter
+        exporter = TreeExporter(args.export_tree, max_depth=args.export_depth, sample_rate=args.export_sample)
+
+    monitor = None
+    aborted = ()
+    # --test runs every benchmark under its own monitor and prints its memory columns
+    if (args.memory or args.memory_limit is not None) and not args.test:
+        from memory_stats import MemoryMonitor, MemoryCeilingExceeded
+        ceiling = None if args.memory_limit is None else int(args.memory_limit * 2**20)
+        monitor = MemoryMonitor(ceiling, trace=args.memory_trace)
+        aborted = MemoryCeilingExceeded
+
+    # Reports go to stderr when stdout carries JSON answers
+    report_stream = sys.stderr if args.job or args.serve_stdin else sys.stdout
+    if args.serve_stdin:
+        action = lambda: serve_stdin(cache, args.workers, exporter, monitor)
+    elif args.job:
+        action = lambda: print(answer(load_job(args.job), cache, args.workers, exporter, monitor))
+    else:
+        action = lambda: run(args, cache, exporter, monitor)
+
+    # The monitor is entered first so that the profiler times its counting TreeNode classes
+    with monitor or contextlib.nullcontext():
+        try:
+            if args.profile:
+                from profiling import SearchProfiler
+                with SearchProfiler(args.profile) as profiler:
+                    action()
+                print(profiler.report(), file=report_stream)
+            else:
+                action()
+        except aborted as error:
+            print(f"Search aborted: {error}", file=report_stream)
+
+    if monitor is not None:
+        print(file=report_stream)
+        print(monitor.report(), file=report_stream)
+
+    if exporter is not None:
+        exporter.close()
+    if cache is not None:
+        cache.close()
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,180 @@
+import sys
+import tracemalloc
+import branch_prune
+import crt_pruning
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+MONITORED_MODULES = [branch_prune, crt_pruning]
+NODE_LIST_ATTRIBUTES = ["p_bits", "q_bits", "dp_bits", "dq_bits", "children"]
+
+
+class MemoryCeilingExceeded(MemoryError):
+    """
+    Raised from inside a search when the memory ceiling of a MemoryMonitor is exceeded.
+    """
+
+
+def node_size(node):
+    """
+    Estimate the bytes held by a tree node: the object, its attribute dictionary and its bit lists.
+
+    Bit lists shared with the parent are counted again, so this is an upper bound.
+    """
+    size = sys.getsizeof(node) + sys.getsizeof(node.__dict__)
+    for name in NODE_LIST_ATTRIBUTES:
+        if name in node.__dict__:
+            size += sys.getsizeof(node.__dict__[name])
+    return size
+
+
+def current_rss():
+    """
+    Resident set size of the process in bytes, or None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (OSError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """
+    Peak resident set size of the process in bytes, or None without the resource module.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryMonitor:
+    """
+    Context manager tracking the memory used by the engines.
+
+        with MemoryMonitor(ceiling=2 << 30) as monitor:
+            branch_and_prune(N, known_bits_p, known_bits_q, monitor=monitor)
+        print(monitor.report())
+
+    While it is active the TreeNode classes of the engines are swapped for subclasses that
+    count the nodes of each tree and sample their size. The engines keep every node of a
+    tree reachable from its root until the search of that tree ends, so the size of the
+    largest tree is the peak number of reachable nodes. The engines report their stack size
+    through step(), which also checks the ceiling every check_interval calls and raises
+    MemoryCeilingExceeded once the traced memory (or the RSS, without tracemalloc) is above it.
+
+    tracemalloc slows the search down several times, so it is only started with trace=True.
+    """
+
+    def __init__(self, ceiling=None, trace=False, check_interval=1024, sample_interval=256):
+        self.ceiling = ceiling
+        self.trace = trace
+        self.check_interval = check_interval
+        self.sample_interval = sample_interval
+        self.tree_nodes = 0
+        self.peak_tree_nodes = 0
+        self.nodes_created = 0
+        self.peak_stack = 0
+        self.steps = 0
+        self.sampled_bytes = 0
+        self.sampled_nodes = 0
+        self.tracemalloc_peak = None
+        self.started_tracing = False
+        self.saved = []
+
+    def counting_class(self, tree_node):
+        monitor = self
+
+        class CountedTreeNode(tree_node):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                monitor.node_created(self)
+
+        CountedTreeNode.__name__ = tree_node.__name__
+        return CountedTreeNode
+
+    def __enter__(self):
+        for module in MONITORED_MODULES:
+            tree_node = module.TreeNode
+            self.saved.append((module, tree_node))
+            module.TreeNode = self.counting_class(tree_node)
+        if self.trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for module, tree_node in reversed(self.saved):
+            module.TreeNode = tree_node
+        self.saved = []
+        if tracemalloc.is_tracing():
+            self.tracemalloc_peak = tracemalloc.get_traced_memory()[1]
+            if self.started_tracing:
+                tracemalloc.stop()
+                self.started_tracing = False
+
+    def node_created(self, node):
+        self.nodes_created += 1
+        # A root starts a new tree, and the previous one is dropped by the engine
+        self.tree_nodes = 1 if node.bit_pos == 0 else self.tree_nodes + 1
+        if self.tree_nodes > self.peak_tree_nodes:
+            self.peak_tree_nodes = self.tree_nodes
+        if self.nodes_created % self.sample_interval == 1:
+            self.sampled_bytes += node_size(node)
+            self.sampled_nodes += 1
+
+    def step(self, stack_size):
+        """
+        Called by the engines once per node taken from their stack.
+
+        :param stack_size: Current size of the DFS stack
+        """
+        self.steps += 1
+        if stack_size > self.peak_stack:
+            self.peak_stack = stack_size
+        if self.ceiling is not None and self.steps % self.check_interval == 0:
+            used = self.memory_in_use()
+            if used is not None and used > self.ceiling:
+                raise MemoryCeilingExceeded(
+                    f"memory in use {used} bytes is above the ceiling of {self.ceiling} bytes "
+                    f"({self.tree_nodes} nodes in the tree, stack of {stack_size})")
+
+    def memory_in_use(self):
+        if tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[0]
+        return current_rss()
+
+    def bytes_per_node(self):
+        return self.sampled_bytes / self.sampled_nodes if self.sampled_nodes else 0.0
+
+    def stats(self):
+        tracemalloc_peak = self.tracemalloc_peak
+        if tracemalloc_peak is None and tracemalloc.is_tracing():
+            tracemalloc_peak = tracemalloc.get_traced_memory()[1]
+        return {
+            "nodes_created": self.nodes_created,
+            "peak_tree_nodes": self.peak_tree_nodes,
+            "peak_stack": self.peak_stack,
+            "bytes_per_node": self.bytes_per_node(),
+            "tracemalloc_peak": tracemalloc_peak,
+            "peak_rss": peak_rss(),
+        }
+
+    def report(self):
+        stats = self.stats()
+        lines = [
+            f"Nodes created:       {stats['nodes_created']}",
+            f"Peak tree size:      {stats['peak_tree_nodes']} nodes",
+            f"Peak stack size:     {stats['peak_stack']}",
+            f"Bytes per node:      {stats['bytes_per_node']:.0f} (estimated)",
+        ]
+        if stats["tracemalloc_peak"] is not None:
+            lines.append(f"Peak traced memory:  {stats['tracemalloc_peak'] / 2**20:.2f} MiB")
+        if stats["peak_rss"] is not None:
+            lines.append(f"Peak RSS:            {stats['peak_rss'] / 2**20:.2f} MiB")
+        return "\n".join(lines)
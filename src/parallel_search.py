@@ -0,0 +1,403 @@
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import branch_prune
+import crt_pruning
+from helpers import *
+
+
+# Expansions between two looks at the steal requests of a busy worker
+POLL_INTERVAL = 64
+
+# Seconds an idle worker waits for the answer of a victim before trying another one
+STEAL_TIMEOUT = 0.05
+
+# The tree is expanded breadth-first until there are this many states per worker to hand out
+INITIAL_STATES_PER_WORKER = 4
+
+MODES = ("process", "thread")
+
+
+def free_threaded():
+    """
+    :return: True if this is a free-threaded CPython build running without the GIL
+    """
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def default_mode():
+    """
+    Threads where they run in parallel (free-threaded builds), processes elsewhere, unless
+    RSA_PARALLEL_MODE says otherwise.
+
+    :return: "thread" or "process"
+    """
+    mode = os.environ.get("RSA_PARALLEL_MODE") or ("thread" if free_threaded() else "process")
+    if mode not in MODES:
+        raise ValueError(f"Unknown parallel mode {mode!r}, expected one of {', '.join(MODES)}")
+    return mode
+
+
+class BranchPruneProblem:
+    """
+    Search states of branch_prune: tuples (p_bits, q_bits, level, symmetric).
+    """
+
+    def __init__(self, N, known_bits_p, known_bits_q):
+        self.N = N
+        self.bit_length = max(len(known_bits_p), len(known_bits_q))
+        self.known_bits_p, self.known_bits_q, p_init, q_init, symmetric = branch_prune.prepare(known_bits_p,
+                                                                                                known_bits_q)
+        self.p_known_from = known_suffix_start(self.known_bits_p)
+        self.completion_level = min(self.p_known_from, known_suffix_start(self.known_bits_q))
+        self.roots = [(p_init, q_init, 0, symmetric)]
+
+    def level(self, state):
+        return state[2]
+
+    def expand(self, state):
+        p, q, i, symmetric = state
+        if i == self.completion_level:
+            # The subtree is solved by a division: keep its only candidate leaf, if any
+            solution = branch_prune.complete(self.N, self.known_bits_p, self.known_bits_q, p, q, i,
+                                             self.p_known_from <= i)
+            return [] if solution is None else [solution + (self.bit_length, False)]
+        return [(p_bits, q_bits, i + 1, child_symmetric) for p_bits, q_bits, child_symmetric
+                in branch_prune.expand(self.N, self.known_bits_p, self.known_bits_q, p, q, i, symmetric)]
+
+    def solution(self, state):
+        p, q, i, _ = state
+        if is_valid(p, q, i, self.N) and verify_factors(p, q, self.N):
+            return p, q
+        return None
+
+
+class CRTProblem:
+    """
+    Search states of crt_pruning: tuples (kp, kq, p_bits, q_bits, dp_bits, dq_bits, level, symmetric).
+    The trees of all kp values are searched at once.
+    """
+
+    def __init__(self, N, e, known_bits_dp, known_bits_dq):
+        self.N = N
+        self.e = e
+        self.bit_length = max(len(known_bits_dp), len(known_bits_dq))
+        (self.known_bits_dp, self.known_bits_dq, p_init, q_init,
+         dp_init, dq_init, symmetric) = crt_pruning.prepare(known_bits_dp, known_bits_dq)
+        self.dp_known_from = known_suffix_start(self.known_bits_dp)
+        self.completion_level = min(self.dp_known_from, known_suffix_start(self.known_bits_dq))
+        self.roots = [(kp, kq, p_init, q_init, dp_init, dq_init, 0, kp == kq and symmetric)
+                      for kp, kq in crt_pruning.kp_values(N, e, known_bits_dp, known_bits_dq)]
+
+    def level(self, state):
+        return state[6]
+
+    def expand(self, state):
+        kp, kq, p, q, dp, dq, i, symmetric = state
+        if i == self.completion_level:
+            solution = crt_pruning.complete(self.N, self.e, kp, kq, self.known_bits_dp, self.known_bits_dq,
+                                            p, q, dp, dq, i, self.dp_known_from <= i)
+            return [] if solution is None else [(kp, kq) + solution + (self.bit_length, False)]
+        return [(kp, kq) + child[:4] + (i + 1, child[4]) for child
+                in crt_pruning.expand(self.N, self.e, kp, kq, self.known_bits_dp, self.known_bits_dq,
+                                      p, q, dp, dq, i, symmetric)]
+
+    def solution(self, state):
+        kp, kq, p, q, dp, dq, i, _ = state
+        if verify_integer_relations(dp, dq, p, q, self.e, self.N, kp, kq):
+            # Same tuple as branch_and_prune_crt, without a tree
+            return p, q, dp, dq, None, kp, kq
+        return None
+
+
+def initial_states(problem, count):
+    """
+    Expand the tree breadth-first until it has count pending states.
+
+    :return: Tuple (pending states, solution found on the way or None)
+    """
+    pending = list(problem.roots)
+    while pending and len(pending) < count:
+        state = pending.pop(0)
+        if problem.level(state) == problem.bit_length:
+            solution = problem.solution(state)
+            if solution is not None:
+                return [], solution
+        else:
+            pending.extend(problem.expand(state))
+        if all(problem.level(state) == problem.bit_length for state in pending):
+            break
+    return pending, None
+
+
+def dfs(problem, stack):
+    """
+    Plain DFS from a list of pending states, used when there is a single worker.
+    """
+    while stack:
+        state = stack.pop()
+        if problem.level(state) == problem.bit_length:
+            solution = problem.solution(state)
+            if solution is not None:
+                return solution
+        else:
+            stack.extend(problem.expand(state))
+    return None
+
+
+class StealBoard:
+    """
+    Shared state of the workers.
+
+    requests[v] holds 1 + the index of the worker waiting for states from worker v (0 if
+    none); the victim answers on the inbox queue of the thief. active counts the workers
+    with pending states, plus the batches of states on their way to a thief, so that the
+    search is over when it drops to zero.
+    """
+
+    def __init__(self, context, workers):
+        self.lock = context.Lock()
+        self.requests = context.Array("i", workers, lock=False)
+        self.inboxes = [context.Queue() for _ in range(workers)]
+        self.active = context.Value("i", 0)
+        self.found = context.Event()
+        self.results = context.Queue()
+
+
+class ThreadValue:
+    """
+    Counter shared by worker threads, with the interface of multiprocessing.Value.
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self.lock = threading.Lock()
+
+    def get_lock(self):
+        return self.lock
+
+
+class ThreadStealBoard:
+    """
+    StealBoard for worker threads: same fields, built on threading and queue.
+    """
+
+    def __init__(self, workers):
+        self.lock = threading.Lock()
+        self.requests = [0] * workers
+        self.inboxes = [queue.Queue() for _ in range(workers)]
+        self.active = ThreadValue(0)
+        self.found = threading.Event()
+        self.results = queue.Queue()
+
+
+def answer_steal(index, stack, board):
+    """
+    Answer a pending steal request with the shallowest half of the stack.
+    """
+    thief = board.requests[index] - 1
+    if thief < 0:
+        return
+    board.requests[index] = 0
+    given = []
+    if len(stack) >= 2:
+        # The bottom of a DFS stack holds the shallowest, and so the largest, pending subtrees
+        given = stack[:len(stack) // 2]
+        del stack[:len(given)]
+        with board.active.get_lock():
+            board.active.value += 1
+    board.inboxes[thief].put(given)
+
+
+def steal(index, workers, board, rng):
+    """
+    Ask a random victim for states and wait for its answer.
+
+    :return: List of stolen states, empty if the victim had none or did not answer in time
+    """
+    victim = rng.randrange(workers - 1)
+    if victim >= index:
+        victim += 1
+    with board.lock:
+        if board.requests[victim] != 0:
+            return []
+        board.requests[victim] = index + 1
+    try:
+        return board.inboxes[index].get(timeout=STEAL_TIMEOUT)
+    except queue.Empty:
+        return []
+
+
+def worker_main(index, workers, problem, stack, board):
+    rng = random.Random(index)
+    steps = 0
+    while not board.found.is_set():
+        if stack:
+            state = stack.pop()
+            if problem.level(state) == problem.bit_length:
+                solution = problem.solution(state)
+                if solution is not None:
+                    board.results.put(solution)
+                    board.found.set()
+                    return
+            else:
+                stack.extend(problem.expand(state))
+            steps += 1
+            if steps % POLL_INTERVAL == 0:
+                answer_steal(index, stack, board)
+            if not stack:
+                with board.active.get_lock():
+                    board.active.value -= 1
+        else:
+            answer_steal(index, stack, board)
+            if board.active.value == 0:
+                return
+            # Batches answering an earlier, timed out request may be waiting in the inbox
+            try:
+                stack.extend(board.inboxes[index].get_nowait())
+            except queue.Empty:
+                stack.extend(steal(index, workers, board, rng))
+
+
+def parallel_search(problem, workers=None, mode=None):
+    """
+    Search the tree of a problem with work-stealing workers.
+
+    Each worker runs DFS on its own stack. An idle worker asks a random victim for states,
+    and the victim hands over the shallowest half of its stack at its next poll. The first
+    verified solution stops every worker.
+
+    Worker processes get a copy of the problem and exchange pickled states. Worker threads
+    share the problem, with its prepared known bits and kp candidates, and hand over
+    states without copies, but only run in parallel on free-threaded builds.
+
+    :param problem: BranchPruneProblem or CRTProblem
+    :param workers: Number of workers (default: CPU count)
+    :param mode: "process" or "thread" (default: default_mode())
+    :return: The solution, in the format of the serial engine, or None
+    """
+    workers = workers or os.cpu_count() or 1
+    mode = mode or default_mode()
+    if mode not in MODES:
+        raise ValueError(f"Unknown parallel mode {mode!r}, expected one of {', '.join(MODES)}")
+    states, solution = initial_states(problem, workers * INITIAL_STATES_PER_WORKER)
+    if solution is not None or not states:
+        return solution
+    if workers == 1:
+        return dfs(problem, states)
+
+    assignments = [states[index::workers] for index in range(workers)]
+    if mode == "thread":
+        board = ThreadStealBoard(workers)
+        start = threading.Thread
+    else:
+        context = multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn")
+        board = StealBoard(context, workers)
+        start = context.Process
+    board.active.value = sum(1 for assignment in assignments if assignment)
+    runners = [start(target=worker_main, args=(index, workers, problem, assignments[index], board), daemon=True)
+               for index in range(workers)]
+    for runner in runners:
+        runner.start()
+
+    solution = None
+    try:
+        while True:
+            try:
+                solution = board.results.get(timeout=STEAL_TIMEOUT)
+                break
+            except queue.Empty:
+                if board.active.value == 0 or not any(runner.is_alive() for runner in runners):
+                    try:
+                        solution = board.results.get_nowait()
+                    except queue.Empty:
+                        pass
+                    break
+    finally:
+        board.found.set()
+        if mode == "process":
+            # Whatever the workers still hold is not needed anymore, so they are all stopped at
+            # once instead of waiting for each to notice found
+            for runner in runners:
+                runner.terminate()
+        # Threads stop at their next look at found, within STEAL_TIMEOUT when idle
+        for runner in runners:
+            runner.join()
+    return solution
+
+
+def parallel_branch_and_prune(N, known_bits_p, known_bits_q, workers=None, mode=None):
+    """
+    branch_and_prune on several workers with work stealing.
+
+    :param N: The product of p and q
+    :param known_bits_p: Known bits of p
+    :param known_bits_q: Known bits of q
+    :param workers: Number of workers (default: CPU count)
+    :param mode: "process" or "thread" (default: default_mode())
+    :return: Tuple of bit sequences for p and q if found, None otherwise
+    """
+    return parallel_search(BranchPruneProblem(N, known_bits_p, known_bits_q), workers, mode)
+
+
+def parallel_branch_and_prune_crt(N, e, known_bits_dp, known_bits_dq, workers=None, mode=None):
+    """
+    branch_and_prune_crt on several workers with work stealing. The trees of all kp
+    values are shared among the workers.
+
+    :param N: The product of p and q
+    :param e: The public exponent
+    :param known_bits_dp: Known bits of dp
+    :param known_bits_dq: Known bits of dq
+    :param workers: Number of workers (default: CPU count)
+    :param mode: "process" or "thread" (default: default_mode())
+    :return: Same tuple as branch_and_prune_crt, with None as the root node
+    """
+    return parallel_search(CRTProblem(N, e, known_bits_dp, known_bits_dq), workers, mode)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Time the work-stealing search, with worker processes and '
+                                                 'threads, against the serial engines')
+    parser.add_argument('--engine', choices=['branch_prune', 'crt_pruning'], default='branch_prune')
+    parser.add_argument('--revealrate', type=float, default=0.5, help='Bit reveal rate of the generated key')
+    parser.add_argument('--bitsize', type=int, default=128, help='Bit size for p and q')
+    parser.add_argument('--e', type=int, default=17, help='Public exponent for crt_pruning')
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    if args.engine == 'branch_prune':
+        N, p, q, p_bits, q_bits, p_erased, q_erased = example_generator(args.revealrate, args.bitsize)
+        serial = lambda: branch_prune.branch_and_prune(N, p_erased, q_erased)
+        parallel = lambda workers, mode: parallel_branch_and_prune(N, p_erased, q_erased, workers, mode)
+    else:
+        N, dp_bits, dq_bits, dp, dq, dp_erased, dq_erased, p, q = example_generator_crt_pruning(
+            args.revealrate, args.bitsize, args.e)
+        serial = lambda: crt_pruning.branch_and_prune_crt(N, args.e, dp_erased, dq_erased)
+        parallel = lambda workers, mode: parallel_branch_and_prune_crt(N, args.e, dp_erased, dq_erased, workers,
+                                                                       mode)
+
+    print(f"free-threaded build: {'yes' if free_threaded() else 'no'}, default mode: {default_mode()}")
+    start_time = time.perf_counter()
+    found = serial() is not None
+    serial_time = time.perf_counter() - start_time
+    print(f"serial                {serial_time:8.3f}s  {'found' if found else 'not found'}")
+    for mode in args.modes:
+        for workers in sorted(set(args.workers)):
+            start_time = time.perf_counter()
+            found = parallel(workers, mode) is not None
+            elapsed = time.perf_counter() - start_time
+            print(f"{workers:>2} {mode:<7} workers  {elapsed:8.3f}s  {'found' if found else 'not found'}  "
+                  f"speedup {serial_time / elapsed:5.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,17 @@
 from helpers import *
 from branch_prune import branch_and_prune
 from crt_pruning import branch_and_prune_crt
+from memory_stats import MemoryMonitor, MemoryCeilingExceeded
+import baselines
 import time
-import matplotlib.pyplot as plt
-import matplotlib.pyplot as plt
 
-def run_branch_prune(revealrate, bitsize):
+def run_branch_prune(revealrate, bitsize, monitor=None):
     """
     Run the first algorithm with a given reveal rate and bit size and measure the time taken.
 
     :param revealrate: The rate at which bits are revealed (0 to 1).
     :param bitsize: The desired bitsize for p and q.
+    :param monitor: Optional MemoryMonitor passed to the algorithm.
     :return: Time taken to run the algorithm.
     """
     start_time = time.time()
@@ -19,20 +20,21 @@ def run_branch_prune(revealrate, bitsize):
     N, p, q, p_bits, q_bits, p_erased, q_erased = example_generator(revealrate, bitsize)
 
     # Run the branch and prune algorithm
-    result = branch_and_prune(N, p_erased, q_erased)
+    result = branch_and_prune(N, p_erased, q_erased, monitor=monitor)
 
     end_time = time.time()
     elapsed_time = end_time - start_time
     
     return elapsed_time, result
 
-def run_crt_pruning(revealrate, bitsize, e=17):
+def run_crt_pruning(revealrate, bitsize, e=17, monitor=None):
     """
     Run the second algorithm with CRT pruning, given a reveal rate, bit size, and public exponent e, and measure the time taken.
 
     :param revealrate: The rate at which bits are revealed (0 to 1).
     :param bitsize: The desired bitsize for p and q.
     :param e: The public exponent (default is 17).
+    :param monitor: Optional MemoryMonitor passed to the algorithm.
     :return: Time taken to run the algorithm.
     """
     start_time = time.time()
@@ -41,38 +43,68 @@ def run_crt_pruning(revealrate, bitsize, e=17):
     N, dp_bits, dq_bits, dp, dq, dp_erased, dq_erased, p, q = example_generator_crt_pruning(revealrate, bitsize, e)
 
     # Run the branch and prune algorithm
-    result = branch_and_prune_crt(N, e, dp_erased, dq_erased)
+    result = branch_and_prune_crt(N, e, dp_erased, dq_erased, monitor=monitor)
 
     end_time = time.time()
     elapsed_time = end_time - start_time
     
     return elapsed_time, result
 
-import math
+def run_with_memory(run, *args, memory=False, ceiling=None, trace=False):
+    """
+    Run one of the benchmark functions above, optionally under a MemoryMonitor.
+
+    Timings taken with memory accounting include its overhead, several times the search
+    time with trace.
+
+    :param run: run_branch_prune or run_crt_pruning.
+    :param args: Arguments of run.
+    :param memory: Whether to collect memory statistics.
+    :param ceiling: Optional memory ceiling in bytes, the run is aborted above it.
+    :param trace: Whether to trace allocations with tracemalloc.
+    :return: Tuple (time taken, result, memory statistics or None); the time is nan if the run was aborted.
+    """
+    if not memory and ceiling is None:
+        elapsed_time, result = run(*args)
+        return elapsed_time, result, None
+
+    with MemoryMonitor(ceiling, trace=trace) as monitor:
+        try:
+            elapsed_time, result = run(*args, monitor=monitor)
+        except MemoryCeilingExceeded as error:
+            print(f"Aborted: {error}")
+            elapsed_time, result = float("nan"), None
+    return elapsed_time, result, monitor.stats()
+
+def print_memory(stats):
+    if stats is None:
+        return
+    traced = "" if stats['tracemalloc_peak'] is None else f", traced peak {stats['tracemalloc_peak'] / 2**20:.2f} MiB"
+    print(f"Memory: {stats['nodes_created']} nodes, largest tree {stats['peak_tree_nodes']}, "
+          f"peak stack {stats['peak_stack']}, ~{stats['bytes_per_node']:.0f} bytes/node{traced}")
 
 def fermat_factorization(N):
     """
-    Factorize N using Fermat's factorization method.
+    Factorize N using Fermat's factorization method (exact isqrt version from baselines).
 
     :param N: The number to factorize.
     :return: A tuple (p, q) if factors are found, else (None, None).
     """
-    if N % 2 == 0:
-        return N // 2, 2  # Handle even N case
-
-    a = math.ceil(math.sqrt(N))
-    b2 = a * a - N
-    b = math.isqrt(b2)
-
-    while b * b != b2:
-        a += 1
-        b2 = a * a - N
-        b = math.isqrt(b2)
+    result = baselines.fermat(N)
+    return result if result is not None else (None, None)
 
-    p = a - b
-    q = a + b
+def run_baseline_factorization(name, revealrate, bitsize, max_seconds=baselines.DEFAULT_MAX_SECONDS):
+    """
+    Run one of the classical factoring baselines on a generated N and measure the time taken.
 
-    return p, q
+    :param name: Name of the baseline, one of baselines.BASELINES.
+    :param revealrate: The rate at which bits are revealed (0 to 1), unused by the baselines.
+    :param bitsize: The desired bitsize for p and q.
+    :param max_seconds: Time budget of the baseline.
+    :return: Time taken to run the algorithm.
+    """
+    N, p, q, p_bits, q_bits, p_erased, q_erased = example_generator(revealrate, bitsize)
+    return baselines.run_baseline(name, N, max_seconds=max_seconds)
 
 def run_fermat_factorization(revealrate, bitsize):
     """
@@ -82,29 +114,26 @@ def run_fermat_factorization(revealrate, bitsize):
     :param bitsize: The desired bitsize for p and q.
     :return: Time taken to run the algorithm.
     """
-    N, p, q, p_bits, q_bits, p_erased, q_erased = example_generator(revealrate, bitsize)
-
-    start_time = time.time()
-    result = fermat_factorization(N)
-    end_time = time.time()
-
-    elapsed_time = end_time - start_time
-    return elapsed_time, result
+    return run_baseline_factorization("fermat", revealrate, bitsize)
 
-def test_algorithm1(bitsize=10):
+def test_algorithm1(bitsize=10, memory=False, ceiling=None, trace=False):
     revealrate_values = [i * 0.05 for i in range(1, 21)]  # From 0.1 to 1.0
     algorithm1_times = []
 
     for revealrate in revealrate_values:
         print("\nRunning Algorithm 1 with reveal rate", revealrate)
-        time_taken_alg1, result_alg1 = run_branch_prune(revealrate, bitsize)
+        time_taken_alg1, result_alg1, memory_alg1 = run_with_memory(run_branch_prune, revealrate, bitsize,
+                                                                    memory=memory, ceiling=ceiling, trace=trace)
         algorithm1_times.append(time_taken_alg1)
 
         # Print results for current reveal rate
         print(f"\nReveal Rate: {revealrate}")
         print(f"Algorithm 1 Time: {time_taken_alg1:.4f} seconds, Result: {'Found' if result_alg1 else 'Not Found'}")
+        print_memory(memory_alg1)
 
     # Plot results for Algorithm 1
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(10, 6))
     plt.plot(revealrate_values, algorithm1_times, marker='o', label='Algorithm 1')
     plt.title('Performance of Algorithm 1')
@@ -114,20 +143,24 @@ def test_algorithm1(bitsize=10):
     plt.grid(True)
     plt.show()
 
-def test_algorithm2(bitsize=10, e=17):
+def test_algorithm2(bitsize=10, e=17, memory=False, ceiling=None, trace=False):
     revealrate_values = [i * 0.1 for i in range(5, 11)]  # From 0.1 to 1.0
     algorithm2_times = []
 
     for revealrate in revealrate_values:
         print("\nRunning Algorithm 2 with reveal rate", revealrate)
-        time_taken_alg2, result_alg2 = run_crt_pruning(revealrate, bitsize, e)
+        time_taken_alg2, result_alg2, memory_alg2 = run_with_memory(run_crt_pruning, revealrate, bitsize, e,
+                                                                    memory=memory, ceiling=ceiling, trace=trace)
         algorithm2_times.append(time_taken_alg2)
 
         # Print results for current reveal rate
         print(f"\nReveal Rate: {revealrate}")
         print(f"Algorithm 2 Time: {time_taken_alg2:.4f} seconds, Result: {'Found' if result_alg2 else 'Not Found'}")
+        print_memory(memory_alg2)
 
     # Plot results for Algorithm 2
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(10, 6))
     plt.plot(revealrate_values, algorithm2_times, marker='o', label='Algorithm 2')
     plt.title('Performance of Algorithm 2')
@@ -138,35 +171,43 @@ def test_algorithm2(bitsize=10, e=17):
     plt.show()
 
 
-def compare_algorithms(bitsize=10, e=17):
+def compare_algorithms(bitsize=10, e=17, memory=False, ceiling=None, trace=False):
     revealrate_values = [i * 0.1 for i in range(5, 11)]  # From 0.5 to 1.0
     algorithm1_times = []
     algorithm2_times = []
-    fermat_times = []
+    baseline_times = {name: [] for name in baselines.BASELINES}
 
     for revealrate in revealrate_values:
         print("\nRunning algorithms with reveal rate", revealrate)
 
         # Run Algorithm 1
-        time_taken_alg1, result_alg1 = run_branch_prune(revealrate, bitsize)
+        time_taken_alg1, result_alg1, memory_alg1 = run_with_memory(run_branch_prune, revealrate, bitsize,
+                                                                    memory=memory, ceiling=ceiling, trace=trace)
         algorithm1_times.append(time_taken_alg1)
         print(f"Algorithm 1 Time: {time_taken_alg1:.4f} seconds, Result: {'Found' if result_alg1 else 'Not Found'}")
+        print_memory(memory_alg1)
 
         # Run Algorithm 2
-        time_taken_alg2, result_alg2 = run_crt_pruning(revealrate, bitsize, e)
+        time_taken_alg2, result_alg2, memory_alg2 = run_with_memory(run_crt_pruning, revealrate, bitsize, e,
+                                                                    memory=memory, ceiling=ceiling, trace=trace)
         algorithm2_times.append(time_taken_alg2)
         print(f"Algorithm 2 Time: {time_taken_alg2:.4f} seconds, Result: {'Found' if result_alg2 else 'Not Found'}")
+        print_memory(memory_alg2)
 
-        # Run Fermat Factorization
-        time_taken_fermat, result_fermat = run_fermat_factorization(revealrate, bitsize)
-        fermat_times.append(time_taken_fermat)
-        print(f"Fermat Factorization Time: {time_taken_fermat:.4f} seconds, Result: {'Found' if result_fermat else 'Not Found'}")
+        # Run the classical factoring baselines
+        for name in baselines.BASELINES:
+            time_taken_baseline, result_baseline = run_baseline_factorization(name, revealrate, bitsize)
+            baseline_times[name].append(time_taken_baseline)
+            print(f"{name} Time: {time_taken_baseline:.4f} seconds, Result: {'Found' if result_baseline else 'Not Found'}")
 
     # Plot results for all algorithms
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(10, 6))
     plt.plot(revealrate_values, algorithm1_times, marker='o', label='Algorithm 1')
     plt.plot(revealrate_values, algorithm2_times, marker='s', label='Algorithm 2')
-    plt.plot(revealrate_values, fermat_times, marker='^', label='Fermat Factorization')
+    for name, times in baseline_times.items():
+        plt.plot(revealrate_values, times, marker='^', label=name)
     plt.title('Performance Comparison of Algorithms')
     plt.xlabel('Reveal Rate')
     plt.ylabel('Time Taken (seconds)')
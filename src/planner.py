@@ -0,0 +1,246 @@
+import os
+import time
+from crt_pruning import kp_values
+from helpers import *
+
+
+# Engines the planner can recommend: the serial DFS of branch_prune / crt_pruning, and the
+# work-stealing search of parallel_search (workers=N)
+ENGINE_DFS = "dfs"
+ENGINE_PARALLEL = "parallel"
+
+# Seconds per unit of work (one candidate child check on one bit), calibrated with calibrate().
+# A CRT child carries four bit lists (p, q, dp, dq) instead of two, hence the larger constant
+SECONDS_PER_UNIT_BRANCH_PRUNE = 7.0e-8
+SECONDS_PER_UNIT_CRT = 8.0e-8
+
+# Above this frontier width there are enough pending subtrees to keep several workers busy
+WIDE_FRONTIER = 1 << 12
+
+# Jobs estimated under this runtime are not worth spreading over several workers
+PARALLEL_THRESHOLD_SECONDS = 1.0
+
+
+class Plan:
+    def __init__(self, engine, workers, node_count, runtime, widths, kp_candidates=None):
+        self.engine = engine
+        self.workers = workers
+        self.node_count = node_count
+        self.runtime = runtime
+        self.widths = widths
+        self.kp_candidates = kp_candidates
+
+    def peak_width(self):
+        return max(self.widths) if self.widths else 0
+
+    def admit(self, max_seconds):
+        """
+        Decide whether the job fits in the given time budget.
+
+        :param max_seconds: Time budget of the job in seconds
+        :return: True if the estimated runtime on the recommended workers fits in the budget
+        """
+        return self.runtime / self.workers <= max_seconds
+
+    def __repr__(self):
+        return (f"Plan(engine={self.engine}, workers={self.workers}, node_count={self.node_count:.3g}, "
+                f"runtime={self.runtime:.3g}s, peak_width={self.peak_width():.3g}, "
+                f"kp_candidates={self.kp_candidates})")
+
+
+def unknown_per_level(known_bits_a, known_bits_b):
+    """
+    Count the erased bits of two values at every level of the search, starting from the lsb.
+
+    :param known_bits_a: Known bits of the first value (msb first, -1 for unknown)
+    :param known_bits_b: Known bits of the second value (msb first, -1 for unknown)
+    :return: List with the number (0, 1 or 2) of unknown bits at each level
+    """
+    known_bits_a, known_bits_b = padding_two_inputs(known_bits_a, known_bits_b)
+    return [(a == -1) + (b == -1) for a, b in zip(known_bits_a[::-1], known_bits_b[::-1])]
+
+
+def expected_frontier(unknown, multiplier=1):
+    """
+    Compute the expected number of surviving nodes at every level of the tree.
+
+    At each level, half of the candidate children of a wrong node survive the congruence
+    check mod 2^(i+1), so a wrong node has 2^(u-1) children when u bits are erased. The
+    correct node keeps itself and spawns exactly 2^(u-1) - 1 wrong siblings.
+
+    :param unknown: Number of unknown bits at each level, as returned by unknown_per_level
+    :param multiplier: Extra growth factor applied to the wrong nodes (used for even kp / kq)
+    :return: Tuple (widths of the correct tree, widths of a tree without the correct path)
+    """
+    wrong = 0.0
+    dead = 1.0
+    widths = []
+    wrong_widths = []
+    for u in unknown:
+        factor = 2 ** (u - 1)
+        wrong = wrong * factor + max(0, factor - 1)
+        dead = dead * factor
+        widths.append(1 + wrong * multiplier)
+        wrong_widths.append(dead * multiplier)
+    return widths, wrong_widths
+
+
+def work_units(widths, unknown, bit_length):
+    """
+    Estimate the work of a search: every node of level i checks 2^u children of bit_length bits.
+
+    :param widths: Expected number of nodes at each level
+    :param unknown: Number of unknown bits at each level
+    :param bit_length: Length of the bit sequences
+    :return: Number of work units
+    """
+    return sum(w * (2 ** u) * bit_length for w, u in zip(widths, unknown))
+
+
+def two_adic_valuation(k):
+    """
+    Number of trailing zero bits of a positive integer.
+
+    :param k: Positive integer
+    :return: Largest t such that 2^t divides k
+    """
+    return (k & -k).bit_length() - 1
+
+
+def recommend_engine(widths, runtime, kp_count=0):
+    """
+    Pick an engine and a worker count from the estimated shape of the search.
+
+    :param widths: Expected frontier width at each level
+    :param runtime: Estimated runtime in seconds of the plain DFS engine
+    :param kp_count: Number of kp candidates (0 for the p, q engine)
+    :return: Tuple (engine, workers)
+    """
+    cpus = os.cpu_count() or 1
+    if runtime < PARALLEL_THRESHOLD_SECONDS or cpus == 1:
+        return ENGINE_DFS, 1
+    # The trees of all kp values are searched by the same pool of workers
+    if kp_count > 1 or max(widths) > WIDE_FRONTIER:
+        return ENGINE_PARALLEL, cpus
+    return ENGINE_DFS, 1
+
+
+def plan_branch_prune(N, known_bits_p, known_bits_q):
+    """
+    Estimate the cost of branch_and_prune and recommend how to run it.
+
+    :param N: The product of p and q
+    :param known_bits_p: Known bits of p
+    :param known_bits_q: Known bits of q
+    :return: Plan for the job
+    """
+    bit_length = max(len(known_bits_p), len(known_bits_q))
+    unknown = unknown_per_level(known_bits_p, known_bits_q)
+    widths, _ = expected_frontier(unknown)
+
+    node_count = sum(widths)
+    runtime = work_units(widths, unknown, bit_length) * SECONDS_PER_UNIT_BRANCH_PRUNE
+    engine, workers = recommend_engine(widths, runtime)
+    return Plan(engine, workers, node_count, runtime, widths)
+
+
+def plan_crt(N, e, known_bits_dp, known_bits_dq):
+    """
+    Estimate the cost of branch_and_prune_crt and recommend how to run it.
+
+    The correct kp is not known in advance, so on average half of the wrong kp trees
+    are explored before the solution is found.
+
+    :param N: The product of p and q
+    :param e: The public exponent
+    :param known_bits_dp: Known bits of dp
+    :param known_bits_dq: Known bits of dq
+    :return: Plan for the job
+    """
+    bit_length = max(len(known_bits_dp), len(known_bits_dq))
+    unknown = unknown_per_level(known_bits_dp, known_bits_dq)
+    candidates = kp_values(N, e, known_bits_dp, known_bits_dq)
+
+    # The shape of a kp tree only depends on the 2-adic valuations of kp and kq, so the
+    # frontier is computed once per pair of valuations (a handful even for e = 65537)
+    groups = {}
+    for kp, kq in candidates:
+        valuations = (two_adic_valuation(kp), two_adic_valuation(kq) if kq else 0)
+        groups[valuations] = groups.get(valuations, 0) + 1
+
+    widths = [0.0] * bit_length
+    correct_work = 0.0
+    wrong_work = 0.0
+    correct_nodes = 0.0
+    wrong_nodes = 0.0
+    for (t_p, t_q), size in groups.items():
+        # p (resp. q) bits hidden by the 2-adic valuation of kp (resp. kq) are left free
+        correct, wrong = expected_frontier(unknown, 2 ** (t_p + t_q))
+        correct_work = max(correct_work, work_units(correct, unknown, bit_length))
+        wrong_work += size * work_units(wrong, unknown, bit_length)
+        correct_nodes = max(correct_nodes, sum(correct))
+        wrong_nodes += size * sum(wrong)
+        widths = [max(w, c) for w, c in zip(widths, correct)]
+
+    units = correct_work + wrong_work / 2
+    # Nodes counted like in plan_branch_prune, with half of the wrong kp trees as for the work
+    node_count = correct_nodes + wrong_nodes / 2
+    runtime = units * SECONDS_PER_UNIT_CRT
+    engine, workers = recommend_engine(widths, runtime, len(candidates))
+    return Plan(engine, workers, node_count, runtime, widths, len(candidates))
+
+
+def calibrate(bitsizes=(12, 16, 20), revealrate=0.6, trials=3, e=17):
+    """
+    Fit the seconds-per-unit constants of the planner from benchmark runs on generated examples.
+
+    :param bitsizes: Bit sizes of p and q to benchmark
+    :param revealrate: The rate at which bits are revealed (0 to 1)
+    :param trials: Number of examples per bit size
+    :param e: The public exponent used for the CRT engine
+    :return: Tuple (seconds per unit for branch_and_prune, seconds per unit for branch_and_prune_crt)
+    """
+    from branch_prune import branch_and_prune
+    from crt_pruning import branch_and_prune_crt
+
+    global SECONDS_PER_UNIT_BRANCH_PRUNE, SECONDS_PER_UNIT_CRT
+
+    predicted_bp, measured_bp = 0.0, 0.0
+    predicted_crt, measured_crt = 0.0, 0.0
+    for bitsize in bitsizes:
+        for _ in range(trials):
+            N, p, q, p_bits, q_bits, p_erased, q_erased = example_generator(revealrate, bitsize)
+            predicted_bp += plan_branch_prune(N, p_erased, q_erased).runtime / SECONDS_PER_UNIT_BRANCH_PRUNE
+            start_time = time.perf_counter()
+            branch_and_prune(N, p_erased, q_erased)
+            measured_bp += time.perf_counter() - start_time
+
+            N, dp_bits, dq_bits, dp, dq, dp_erased, dq_erased, p, q = example_generator_crt_pruning(revealrate, bitsize, e)
+            predicted_crt += plan_crt(N, e, dp_erased, dq_erased).runtime / SECONDS_PER_UNIT_CRT
+            start_time = time.perf_counter()
+            branch_and_prune_crt(N, e, dp_erased, dq_erased)
+            measured_crt += time.perf_counter() - start_time
+
+    SECONDS_PER_UNIT_BRANCH_PRUNE = measured_bp / predicted_bp
+    SECONDS_PER_UNIT_CRT = measured_crt / predicted_crt
+    return SECONDS_PER_UNIT_BRANCH_PRUNE, SECONDS_PER_UNIT_CRT
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Estimate the cost of a recovery job')
+    parser.add_argument('--revealrate', type=float, default=0.5, help='Bit reveal rate of the generated example')
+    parser.add_argument('--bitsize', type=int, default=64, help='Bit size for RSA components')
+    parser.add_argument('--e', type=int, default=17, help='Public exponent for RSA')
+    parser.add_argument('--calibrate', action='store_true', help='Calibrate the cost model before planning')
+    args = parser.parse_args()
+
+    if args.calibrate:
+        print("Calibrated seconds per unit (branch_prune, crt_pruning):", calibrate(e=args.e))
+
+    N, p, q, p_bits, q_bits, p_erased, q_erased = example_generator(args.revealrate, args.bitsize)
+    print("Branch and prune:", plan_branch_prune(N, p_erased, q_erased))
+
+    N, dp_bits, dq_bits, dp, dq, dp_erased, dq_erased, p, q = example_generator_crt_pruning(args.revealrate, args.bitsize, args.e)
+    print("CRT pruning:", plan_crt(N, args.e, dp_erased, dq_erased))
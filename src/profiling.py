@@ -0,0 +1,121 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+import branch_prune
+import crt_pruning
+import helpers
+import parallel_search
+
+
+# Hot-path functions of the engines, grouped by the part of the search they time. The
+# engines are not instrumented: while a profiler is active their module globals are swapped
+# for timed wrappers, so nothing is added to the search loops when profiling is off.
+# The serial branch_prune engine builds its children and checks them mod 2^(i+1) inline,
+# so for it only TreeNode and bits_to_int show up in these rows; cProfile has the rest.
+# lift_2adic_inverse is an lru_cache, so its timer wraps the cached callable: cache hits are
+# timed too, and while profiling the module attribute has no cache_info or cache_clear.
+HOT_PATHS = {
+    "child generation": ["expand", "TreeNode"],
+    "early completion": ["complete"],
+    "congruence checks": ["is_valid", "congruence_bit_candidates", "solve_2adic", "lift_2adic_inverse"],
+    "bits_to_int": ["bits_to_int"],
+    "leaf verification": ["verify_factors", "verify_integer_relations"],
+}
+
+PROFILED_MODULES = [branch_prune, crt_pruning, helpers, parallel_search]
+
+
+class HotPathTimer:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        # Nesting depth per thread: a function of a category calling another one of the same
+        # category (congruence_bit_candidates -> solve_2adic) is only timed once
+        self.local = threading.local()
+
+    def wrap(self, function):
+        def timed(*args, **kwargs):
+            depth = getattr(self.local, "depth", 0)
+            self.local.depth = depth + 1
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                if depth == 0:
+                    self.seconds += time.perf_counter() - start_time
+                self.local.depth = depth
+                self.calls += 1
+        return timed
+
+
+class SearchProfiler:
+    """
+    Context manager collecting cProfile data and hot-path timers around the engines.
+
+        with SearchProfiler("search.prof") as profiler:
+            branch_and_prune(N, known_bits_p, known_bits_q)
+        print(profiler.report())
+
+    On exit the pstats dump is written to dump_path (loadable with pstats, snakeviz, ...)
+    and the sorted text report next to it with a .txt suffix.
+    """
+
+    def __init__(self, dump_path=None, sort_by="cumulative", limit=30):
+        self.dump_path = dump_path
+        self.sort_by = sort_by
+        self.limit = limit
+        self.timers = {category: HotPathTimer(category) for category in HOT_PATHS}
+        self.profile = cProfile.Profile()
+        self.saved = []
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        for category, names in HOT_PATHS.items():
+            timer = self.timers[category]
+            for module in PROFILED_MODULES:
+                for name in names:
+                    if hasattr(module, name):
+                        function = getattr(module, name)
+                        self.saved.append((module, name, function))
+                        setattr(module, name, timer.wrap(function))
+        self.start_time = time.perf_counter()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profile.disable()
+        self.elapsed = time.perf_counter() - self.start_time
+        for module, name, function in reversed(self.saved):
+            setattr(module, name, function)
+        self.saved = []
+        if self.dump_path is not None:
+            self.profile.dump_stats(self.dump_path)
+            with open(self.dump_path + ".txt", "w") as report_file:
+                report_file.write(self.report())
+
+    def report(self):
+        """
+        Build the text report: hot-path timers, then the cProfile functions sorted by sort_by.
+
+        Timers are inclusive, so the time spent in bits_to_int is also counted in the
+        congruence checks and leaf verifications that call it, and the congruence checks
+        are also counted in the child generation that calls them. Calls nested within one
+        category, such as TreeNode in expand, are timed once. Worker processes of
+        parallel_search are not profiled; worker threads are.
+
+        :return: The report as a string
+        """
+        lines = [f"Total time: {self.elapsed:.4f} seconds", "",
+                 f"{'hot path':<20} {'calls':>12} {'seconds':>10} {'share':>7}"]
+        for timer in sorted(self.timers.values(), key=lambda timer: timer.seconds, reverse=True):
+            share = timer.seconds / self.elapsed if self.elapsed else 0.0
+            lines.append(f"{timer.name:<20} {timer.calls:>12} {timer.seconds:>10.4f} {share:>7.1%}")
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.strip_dirs().sort_stats(self.sort_by).print_stats(self.limit)
+        lines += ["", stream.getvalue()]
+        return "\n".join(lines)
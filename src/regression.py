@@ -0,0 +1,287 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import arithmetic
+import branch_prune
+import crt_pruning
+from helpers import *
+
+
+DEFAULT_HISTORY_PATH = "regression_history.jsonl"
+
+# Reference instances: (name, engine, seed, bitsize, revealrate)
+REFERENCE_INSTANCES = [
+    ("bp-64-0.5", "branch_prune", 1, 64, 0.5),
+    ("bp-128-0.5", "branch_prune", 1, 128, 0.5),
+    ("bp-256-0.6", "branch_prune", 1, 256, 0.6),
+    ("crt-16-0.6", "crt_pruning", 1, 16, 0.6),
+    ("crt-32-0.6", "crt_pruning", 1, 32, 0.6),
+    ("crt-64-0.7", "crt_pruning", 1, 64, 0.7),
+]
+REFERENCE_E = 17
+
+
+def seeded_prime(rng, bits, exact=False):
+    """
+    Draw a prime of at most the given bit length from a seeded random generator, or of
+    exactly that length with exact (the reference instances keep the draws without it).
+    """
+    while True:
+        p = rng.getrandbits(bits) | 1
+        if exact:
+            p |= 1 << (bits - 1)
+        if arithmetic.is_prime(p, 32):
+            return p
+
+
+def reference_instance(engine, seed, bitsize, revealrate, e=REFERENCE_E):
+    """
+    Build a reference instance that only depends on its seed.
+
+    :param engine: "branch_prune" or "crt_pruning"
+    :param seed: Seed of the instance
+    :param bitsize: The bitsize for p and q
+    :param revealrate: The rate at which bits are revealed (0 to 1)
+    :param e: The public exponent of CRT instances
+    :return: Tuple of the arguments of the engine
+    """
+    rng = random.Random(seed)
+    while True:
+        p = seeded_prime(rng, bitsize)
+        q = seeded_prime(rng, bitsize)
+        phi = (p - 1) * (q - 1)
+        if p != q and (engine == "branch_prune" or e < phi - 1 and arithmetic.gcd(e, phi) == 1):
+            break
+    N = p * q
+
+    def erase(bits):
+        return [bit if rng.random() < revealrate else -1 for bit in bits]
+
+    if engine == "branch_prune":
+        p_bits, q_bits = padding_two_inputs(int_to_bits_lsb_end(p), int_to_bits_lsb_end(q))
+        return N, erase(p_bits), erase(q_bits)
+
+    d = mod_inverse(e, phi)
+    N_bits_size = ceil(log(N, 2))
+    dp_bits = padding_input(int_to_bits_lsb_end(d % (p - 1)), N_bits_size)
+    dq_bits = padding_input(int_to_bits_lsb_end(d % (q - 1)), N_bits_size)
+    return N, e, erase(dp_bits), erase(dq_bits)
+
+
+def run_engine(engine, arguments):
+    if engine == "branch_prune":
+        return branch_prune.branch_and_prune(*arguments)
+    return crt_pruning.branch_and_prune_crt(*arguments)
+
+
+def count_nodes(engine, arguments):
+    """
+    Count the tree nodes created by one run of the engine.
+    """
+    module = branch_prune if engine == "branch_prune" else crt_pruning
+    tree_node = module.TreeNode
+    count = [0]
+
+    def counting_tree_node(*args):
+        count[0] += 1
+        return tree_node(*args)
+
+    module.TreeNode = counting_tree_node
+    try:
+        run_engine(engine, arguments)
+    finally:
+        module.TreeNode = tree_node
+    return count[0]
+
+
+def peak_memory(engine, arguments):
+    """
+    Peak memory in bytes allocated during one run of the engine, measured with tracemalloc.
+    """
+    tracemalloc.start()
+    try:
+        run_engine(engine, arguments)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def machine_fingerprint():
+    return {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "arithmetic_backend": arithmetic.BACKEND,
+    }
+
+
+def run_reference_set(repeats=5):
+    """
+    Run every reference instance and measure it.
+
+    Time, node count and peak memory are measured in separate runs so that counting and
+    tracemalloc do not distort the timings.
+
+    :param repeats: Number of timed runs per instance
+    :return: Dictionary mapping instance names to {"times", "nodes", "peak_bytes", "solved"}
+    """
+    results = {}
+    for name, engine, seed, bitsize, revealrate in REFERENCE_INSTANCES:
+        arguments = reference_instance(engine, seed, bitsize, revealrate)
+        times = []
+        solved = False
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            solved = run_engine(engine, arguments) is not None
+            times.append(time.perf_counter() - start_time)
+        results[name] = {
+            "times": times,
+            "nodes": count_nodes(engine, arguments),
+            "peak_bytes": peak_memory(engine, arguments),
+            "solved": solved,
+        }
+    return results
+
+
+def load_history(path=DEFAULT_HISTORY_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path) as history_file:
+        return [json.loads(line) for line in history_file if line.strip()]
+
+
+def save_run(record, path=DEFAULT_HISTORY_PATH):
+    with open(path, "a") as history_file:
+        history_file.write(json.dumps(record) + "\n")
+
+
+def find_baseline(history, label=None, machine=None):
+    """
+    Pick the baseline run: the latest run with the given label, or else the latest run on the same machine.
+    """
+    for record in reversed(history):
+        if label is not None:
+            if record["label"] == label:
+                return record
+        elif machine is None or record["machine"] == machine:
+            return record
+    return None
+
+
+def permutation_p_value(baseline, new, max_permutations=20000, seed=0):
+    """
+    One-sided permutation test: probability of a mean slowdown at least as large as the observed one by chance.
+
+    All splits are enumerated when there are few of them, otherwise random splits are drawn.
+
+    :param baseline: Timings of the baseline run
+    :param new: Timings of the new run
+    :return: p-value of the hypothesis that the new run is not slower
+    """
+    observed = statistics.mean(new) - statistics.mean(baseline)
+    pooled = list(baseline) + list(new)
+    size = len(new)
+    total = sum(pooled)
+
+    def difference(indices):
+        new_sum = sum(pooled[i] for i in indices)
+        return new_sum / size - (total - new_sum) / (len(pooled) - size)
+
+    splits = list(itertools.islice(itertools.combinations(range(len(pooled)), size), max_permutations + 1))
+    if len(splits) > max_permutations:
+        rng = random.Random(seed)
+        splits = [rng.sample(range(len(pooled)), size) for _ in range(max_permutations)]
+    extreme = sum(1 for indices in splits if difference(indices) >= observed - 1e-12)
+    return extreme / len(splits)
+
+
+def compare_runs(baseline, new, threshold=0.10, alpha=0.05, min_seconds=0.002):
+    """
+    Compare a new run with a baseline.
+
+    An instance regresses when its median time grows by more than threshold (and by at least
+    min_seconds, below which timer noise dominates) with a permutation p-value below alpha,
+    when its node count or peak memory grows by more than threshold, or when it is no longer solved.
+
+    :param baseline: Baseline record from the history
+    :param new: New record
+    :param threshold: Relative slowdown tolerated
+    :param alpha: Significance level of the timing test
+    :param min_seconds: Smallest slowdown of the median time that can count as a regression
+    :return: List of rows (name, time change, p-value, node change, memory change, regressed)
+    """
+    rows = []
+    for name, result in new["results"].items():
+        if name not in baseline["results"]:
+            continue
+        reference = baseline["results"][name]
+        slowdown = statistics.median(result["times"]) - statistics.median(reference["times"])
+        time_change = slowdown / statistics.median(reference["times"])
+        p_value = permutation_p_value(reference["times"], result["times"])
+        node_change = result["nodes"] / reference["nodes"] - 1 if reference["nodes"] else 0.0
+        memory_change = result["peak_bytes"] / reference["peak_bytes"] - 1 if reference["peak_bytes"] else 0.0
+        regressed = ((time_change > threshold and slowdown >= min_seconds and p_value < alpha) or node_change > threshold
+                     or memory_change > threshold or (reference["solved"] and not result["solved"]))
+        rows.append((name, time_change, p_value, node_change, memory_change, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Track performance regressions of the engines on reference instances')
+    parser.add_argument('command', choices=['record', 'check'],
+                        help='record: run and store the results; check: run and compare with a baseline')
+    parser.add_argument('--label', default=None, help='Label of the run (default: current time)')
+    parser.add_argument('--baseline', default=None,
+                        help='Label of the baseline run (default: latest run on this machine)')
+    parser.add_argument('--history', default=DEFAULT_HISTORY_PATH, help='History file')
+    parser.add_argument('--repeats', type=int, default=5, help='Timed runs per instance')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Relative slowdown tolerated')
+    parser.add_argument('--alpha', type=float, default=0.05, help='Significance level of the timing test')
+    parser.add_argument('--save', action='store_true', help='Also store the run when checking')
+    args = parser.parse_args()
+
+    machine = machine_fingerprint()
+    record = {
+        "label": args.label or datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "timestamp": time.time(),
+        "machine": machine,
+        "results": run_reference_set(args.repeats),
+    }
+
+    if args.command == "record":
+        save_run(record, args.history)
+        print(f"Recorded run {record['label']} in {args.history}")
+        return 0
+
+    history = load_history(args.history)
+    baseline = find_baseline(history, args.baseline, machine)
+    if args.save:
+        save_run(record, args.history)
+    if baseline is None:
+        print("No baseline run found")
+        return 2
+    if baseline["machine"] != machine:
+        print("Warning: the baseline was recorded on a different machine")
+
+    rows = compare_runs(baseline, record, args.threshold, args.alpha)
+    print(f"Baseline: {baseline['label']}")
+    print(f"{'instance':<12} {'time':>8} {'p-value':>8} {'nodes':>8} {'memory':>8}")
+    for name, time_change, p_value, node_change, memory_change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<12} {time_change:>+8.1%} {p_value:>8.3f} {node_change:>+8.1%} {memory_change:>+8.1%}{flag}")
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+import hashlib
+import os
+import sqlite3
+import time
+from helpers import *
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "rsa-key-recovery", "results.sqlite3")
+DEFAULT_MAX_ENTRIES = 100000
+
+# Hits are written back to last_used in batches of this many
+USE_FLUSH_INTERVAL = 256
+
+# Rows are counted, and the least recently used ones evicted, once per this many inserts
+EVICT_INTERVAL = 256
+
+
+def leak_fingerprint(engine, *known_bits):
+    """
+    Hash a leak pattern so that it can be used as a cache key.
+
+    :param engine: Name of the engine the leak is given to
+    :param known_bits: Known bits of the leaked values (msb first, -1 for unknown)
+    :return: Hex digest identifying the leak
+    """
+    digest = hashlib.sha256(engine.encode())
+    for bits in known_bits:
+        digest.update(b"|" + ",".join(str(bit) for bit in bits).encode())
+    return digest.hexdigest()
+
+
+def matches_known_bits(value, known_bits):
+    """
+    Check that an integer agrees with every known bit of a leak.
+
+    :param value: Candidate integer
+    :param known_bits: Known bits (msb first, -1 for unknown)
+    :return: True if no known bit contradicts the value
+    """
+    bits = int_to_bits_lsb_start(value, len(known_bits))
+    if len(bits) > len(known_bits):
+        return False
+    return all(known == -1 or known == bit for known, bit in zip(known_bits[::-1], bits))
+
+
+def crt_exponents(p, q, e):
+    """
+    Derive dp, dq, kp and kq from the factors of N.
+
+    :param p: First prime factor
+    :param q: Second prime factor
+    :param e: The public exponent
+    :return: Tuple (dp, dq, kp, kq) with e*dp = 1 + kp*(p - 1) and e*dq = 1 + kq*(q - 1),
+             or None if e is not invertible modulo p - 1 or q - 1
+    """
+    dp = mod_inverse(e, p - 1)
+    dq = mod_inverse(e, q - 1)
+    if dp is None or dq is None:
+        return None
+    kp = (e * dp - 1) // (p - 1)
+    kq = (e * dq - 1) // (q - 1)
+    return dp, dq, kp, kq
+
+
+class ResultCache:
+    """
+    On-disk cache of recovery results stored in a SQLite file.
+
+    Factorizations are stored per N, so once N has been factored every later request for it is
+    answered whatever its leak. Failed searches are stored per (N, e, leak fingerprint). The
+    least recently used entries are evicted once the cache holds more than max_entries rows.
+
+    A hit only costs a SELECT: the last use times are kept in memory and written back in
+    batches, before an eviction and when the cache is closed. An insert only costs its
+    INSERT: the tables are counted and trimmed every min(EVICT_INTERVAL, max_entries)
+    inserts and when the cache is closed, so they may briefly hold up to that many extra rows.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_entries = max_entries
+        self.pending_uses = {}
+        self.inserts = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS factors (
+                n TEXT PRIMARY KEY,
+                p TEXT NOT NULL,
+                q TEXT NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS failures (
+                n TEXT NOT NULL,
+                e INTEGER NOT NULL,
+                leak TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (n, e, leak)
+            );
+        """)
+
+    def close(self):
+        if self.inserts:
+            self.evict()
+        self.flush_uses()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_factors(self, N):
+        """
+        Look up the factorization of N.
+
+        :param N: The product of p and q
+        :return: Tuple (p, q) if N has been factored before, None otherwise
+        """
+        row = self.connection.execute("SELECT p, q FROM factors WHERE n = ?", (str(N),)).fetchone()
+        if row is None:
+            return None
+        self.pending_uses[str(N)] = time.time()
+        if len(self.pending_uses) >= USE_FLUSH_INTERVAL:
+            self.flush_uses()
+        return int(row[0]), int(row[1])
+
+    def flush_uses(self):
+        """
+        Write the last use times of the pending hits to the file.
+        """
+        if not self.pending_uses:
+            return
+        with self.connection:
+            self.connection.executemany("UPDATE factors SET last_used = ? WHERE n = ?",
+                                        [(last_used, n) for n, last_used in self.pending_uses.items()])
+        self.pending_uses = {}
+
+    def put_factors(self, N, p, q):
+        """
+        Store the factorization of N and drop the failures recorded for it.
+
+        :param N: The product of p and q
+        :param p: First prime factor
+        :param q: Second prime factor
+        """
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO factors VALUES (?, ?, ?, ?)",
+                                    (str(N), str(p), str(q), time.time()))
+            self.connection.execute("DELETE FROM failures WHERE n = ?", (str(N),))
+        self.count_insert()
+
+    def is_known_failure(self, N, e, leak):
+        """
+        Check whether the search already failed for this N, e and leak fingerprint.
+        """
+        row = self.connection.execute("SELECT 1 FROM failures WHERE n = ? AND e = ? AND leak = ?",
+                                      (str(N), e, leak)).fetchone()
+        return row is not None
+
+    def put_failure(self, N, e, leak):
+        """
+        Record that the search found no solution for this N, e and leak fingerprint.
+        """
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?)",
+                                    (str(N), e, leak, time.time()))
+        self.count_insert()
+
+    def count_insert(self):
+        """
+        Count an insert and evict once enough inserts have been made since the last eviction.
+        """
+        self.inserts += 1
+        if self.inserts >= min(EVICT_INTERVAL, self.max_entries):
+            self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used entries until at most max_entries rows are left.
+        """
+        self.inserts = 0
+        self.flush_uses()
+        with self.connection:
+            for table in ("factors", "failures"):
+                count = self.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                if count > self.max_entries:
+                    self.connection.execute(
+                        f"DELETE FROM {table} WHERE rowid IN "
+                        f"(SELECT rowid FROM {table} ORDER BY last_used LIMIT ?)",
+                        (count - self.max_entries,))
+
+
+def cached_branch_and_prune(cache, N, known_bits_p, known_bits_q, exporter=None, monitor=None, workers=None):
+    """
+    branch_and_prune with a lookup in the result cache first.
+
+    :param cache: ResultCache to use, or None to always run the search
+    :param N: The product of p and q
+    :param known_bits_p: Known bits of p
+    :param known_bits_q: Known bits of q
+    :param exporter: Optional TreeExporter passed to the engine
+    :param monitor: Optional MemoryMonitor passed to the engine
+    :param workers: Number of search processes passed to the engine
+    :return: Same as branch_and_prune
+    """
+    from branch_prune import branch_and_prune
+
+    if cache is None:
+        return branch_and_prune(N, known_bits_p, known_bits_q, exporter, monitor, workers)
+
+    bit_length = max(len(known_bits_p), len(known_bits_q))
+    factors = cache.get_factors(N)
+    if factors is not None:
+        p, q = factors
+        # Return the factors in the order the leak describes them
+        if not matches_known_bits(p, known_bits_p) and matches_known_bits(q, known_bits_p):
+            p, q = q, p
+        return int_to_bits_lsb_start(p, bit_length), int_to_bits_lsb_start(q, bit_length)
+
+    leak = leak_fingerprint("branch_prune", known_bits_p, known_bits_q)
+    if cache.is_known_failure(N, 0, leak):
+        return None
+
+    result = branch_and_prune(N, known_bits_p, known_bits_q, exporter, monitor, workers)
+    if result is None:
+        cache.put_failure(N, 0, leak)
+    else:
+        cache.put_factors(N, bits_to_int(result[0]), bits_to_int(result[1]))
+    return result
+
+
+def cached_branch_and_prune_crt(cache, N, e, known_bits_dp, known_bits_dq, exporter=None, monitor=None, workers=None):
+    """
+    branch_and_prune_crt with a lookup in the result cache first.
+
+    Results served from the cache have no search tree, so their root node is None.
+
+    :param cache: ResultCache to use, or None to always run the search
+    :param N: The product of p and q
+    :param e: The public exponent
+    :param known_bits_dp: Known bits of dp
+    :param known_bits_dq: Known bits of dq
+    :param exporter: Optional TreeExporter passed to the engine
+    :param monitor: Optional MemoryMonitor passed to the engine
+    :param workers: Number of search processes passed to the engine
+    :return: Same as branch_and_prune_crt
+    """
+    from crt_pruning import branch_and_prune_crt
+
+    if cache is None:
+        return branch_and_prune_crt(N, e, known_bits_dp, known_bits_dq, exporter, monitor, workers)
+
+    bit_length = max(len(known_bits_dp), len(known_bits_dq))
+    factors = cache.get_factors(N)
+    if factors is not None:
+        p, q = factors
+        exponents = crt_exponents(p, q, e)
+        if exponents is None:
+            # No dp or dq exists for this e, so the search could not find any either
+            return None
+        dp, dq, kp, kq = exponents
+        if not matches_known_bits(dp, known_bits_dp) and matches_known_bits(dq, known_bits_dp):
+            p, q, dp, dq, kp, kq = q, p, dq, dp, kq, kp
+        return (int_to_bits_lsb_start(p, bit_length), int_to_bits_lsb_start(q, bit_length),
+                int_to_bits_lsb_start(dp, bit_length), int_to_bits_lsb_start(dq, bit_length),
+                None, kp, kq)
+
+    leak = leak_fingerprint("crt_pruning", known_bits_dp, known_bits_dq)
+    if cache.is_known_failure(N, e, leak):
+        return None
+
+    result = branch_and_prune_crt(N, e, known_bits_dp, known_bits_dq, exporter, monitor, workers)
+    if result is None:
+        cache.put_failure(N, e, leak)
+    else:
+        cache.put_factors(N, bits_to_int(result[0]), bits_to_int(result[1]))
+    return result
@@ -1,6 +1,9 @@
 import random
-from math import gcd, ceil
+from math import ceil
 import base64
+import os
+from itertools import islice
+import arithmetic
 
 
 # Function to test if a number is prime using Miller-Rabin primality test
@@ -18,28 +21,7 @@ def miller_rabin(n, k=128):
     output: bool - True if n is prime, False otherwise
     """
     
-    if n == 2 or n == 3:
-        return True
-    if n <= 1 or n % 2 == 0:
-        return False
-
-    r, s = 0, n - 1
-    while s % 2 == 0:
-        r += 1
-        s //= 2
-
-    for _ in range(k):
-        a = random.randrange(2, n - 1)
-        x = pow(a, s, n)
-        if x == 1 or x == n - 1:
-            continue
-        for _ in range(r - 1):
-            x = pow(x, 2, n)
-            if x == n - 1:
-                break
-        else:
-            return False
-    return True
+    return arithmetic.is_prime(n, k)
 
 # Function to generate a prime number of specified bit length
 
@@ -60,36 +42,25 @@ def generate_prime(bits):
 
 def gcd(a, b):
     """ 
-    Compute the greatest common divisor using Euclid's algorithm. 
+    Compute the greatest common divisor through the arithmetic backend. 
     
     a: int - the first number
     b: int - the second number
 
     output: int - the greatest common divisor of a and b
     """
-    while b:
-        a, b = b, a % b
-    return a
+    return arithmetic.gcd(a, b)
 
 def mod_inverse(a, m):
     """ 
-    Compute the modular inverse of a modulo m. The euclidean algorithm is used for its numerical efficiency and stability.
+    Compute the modular inverse of a modulo m through the arithmetic backend.
     
     a: int - the number to compute the inverse of
     m: int - the modulus
 
-    output: int - the modular inverse of a modulo m
+    output: int - the modular inverse of a modulo m, or None if a is not invertible
     """
-    m0, x0, x1 = m, 0, 1
-    if m == 1:
-        return 0
-    while a > 1:
-        q = a // m
-        m, a = a % m, m
-        x0, x1 = x1 - q * x0, x0
-    if x1 < 0:
-        x1 += m0
-    return x1
+    return arithmetic.invert(a, m)
 
 
 
@@ -137,32 +108,136 @@ def encrypt(public_key, plaintext):
     plaintext_bytes = base64.b64encode(plaintext.encode('utf-8'))
     plaintext_int = int.from_bytes(plaintext_bytes, 'big')
     # Encrypt the integer
-    ciphertext = pow(plaintext_int, e, n)
+    ciphertext = arithmetic.powmod(plaintext_int, e, n)
     return ciphertext
 
+def decode_plaintext(m):
+    """ 
+    Convert a decrypted integer back to the plaintext string. 
+    
+    m: int - the decrypted integer
+
+    output: str - the plaintext
+    """
+    num_bytes = ceil(m.bit_length() / 8)
+    
+    # Convert decrypted integer back to bytes and decode from base64
+    decrypted_bytes = m.to_bytes(num_bytes, 'big')
+    return base64.b64decode(decrypted_bytes).decode('utf-8')
+
+class PrivateKey:
+    """ 
+    RSA private key with the CRT values precomputed.
+
+    Decryption exponentiates with dp = d mod (p - 1) and dq = d mod (q - 1), which are half
+    the size of d, and recombines with Garner's formula, which needs the single inverse qinv.
+    """
+
+    def __init__(self, p, q, d):
+        self.p = p
+        self.q = q
+        self.d = d
+        self.dp = d % (p - 1)
+        self.dq = d % (q - 1)
+        self.qinv = mod_inverse(q, p)
+
+    @classmethod
+    def from_tuple(cls, private_key):
+        """ 
+        Build the key from the tuple returned by generate_keypair.
+        
+        private_key: tuple - the private key in the format (p, q, d, qinv, pinv)
+        """
+        p, q, d, qinv, pinv = private_key
+        return cls(p, q, d)
+
+    def decrypt_int(self, ciphertext):
+        """ 
+        Decrypt a ciphertext to the plaintext integer with CRT and Garner's recombination. 
+        
+        ciphertext: int - the ciphertext to decrypt
+
+        output: int - the plaintext integer
+        """
+        m_p = arithmetic.powmod(ciphertext, self.dp, self.p)
+        m_q = arithmetic.powmod(ciphertext, self.dq, self.q)
+        h = (self.qinv * (m_p - m_q)) % self.p
+        return m_q + h * self.q
+
+    def decrypt(self, ciphertext):
+        """ 
+        Decrypt ciphertext to the plaintext string. 
+        
+        ciphertext: int - the ciphertext to decrypt
+
+        output: str - the decrypted plaintext
+        """
+        return decode_plaintext(self.decrypt_int(ciphertext))
+
 def decrypt(private_key, ciphertext):
     """ 
     Decrypt ciphertext using the private key with CRT. 
     
-    private_key: tuple - the private key in the format (p, q, d, qinv, pinv)
+    private_key: tuple - the private key in the format (p, q, d, qinv, pinv), or a PrivateKey
     ciphertext: int - the ciphertext to decrypt
 
     output: str - the decrypted plaintext
     """
-    p, q, d, qinv, pinv = private_key
-    # Compute m_p and m_q
-    m_p = pow(ciphertext, d, p)
-    m_q = pow(ciphertext, d, q)
-    # Combine results using CRT
-    m = (m_p * q * qinv + m_q * p * pinv) % (p * q)
-    
-    
-    num_bytes = ceil(m.bit_length() / 8)
+    if not isinstance(private_key, PrivateKey):
+        private_key = PrivateKey.from_tuple(private_key)
+    return private_key.decrypt(ciphertext)
+
+# Key of the worker processes of decrypt_many, set once by the pool initializer
+_worker_key = None
+
+def _init_decrypt_worker(key):
+    global _worker_key
+    _worker_key = key
+
+def _decrypt_chunk(chunk, raw):
+    if raw:
+        return [_worker_key.decrypt_int(c) for c in chunk]
+    return [_worker_key.decrypt(c) for c in chunk]
+
+def decrypt_many(private_key, ciphertexts, workers=None, chunksize=1024, raw=False):
+    """ 
+    Decrypt a stream of ciphertexts with a process pool, yielding the plaintexts in order.
+
+    Ciphertexts are read lazily in chunks and at most two chunks per worker are in flight,
+    so corpora of millions of messages are processed in bounded memory.
     
-    # Convert decrypted integer back to bytes and decode from base64
-    decrypted_bytes = m.to_bytes(num_bytes, 'big')
-    plaintext = base64.b64decode(decrypted_bytes).decode('utf-8')
-    return plaintext
+    private_key: tuple or PrivateKey - the private key
+    ciphertexts: iterable of int - the ciphertexts to decrypt
+    workers: int - number of worker processes (default: number of CPUs, 1 decrypts in this process)
+    chunksize: int - number of ciphertexts sent to a worker at once
+    raw: bool - yield the plaintext integers instead of the decoded strings
+
+    output: generator of str (or int if raw) - the plaintexts
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if not isinstance(private_key, PrivateKey):
+        private_key = PrivateKey.from_tuple(private_key)
+    workers = workers or os.cpu_count() or 1
+    ciphertexts = iter(ciphertexts)
+
+    if workers == 1:
+        decrypt_one = private_key.decrypt_int if raw else private_key.decrypt
+        for ciphertext in ciphertexts:
+            yield decrypt_one(ciphertext)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_init_decrypt_worker, initargs=(private_key,)) as pool:
+        pending = []
+        while True:
+            while len(pending) < 2 * workers:
+                chunk = list(islice(ciphertexts, chunksize))
+                if not chunk:
+                    break
+                pending.append(pool.submit(_decrypt_chunk, chunk, raw))
+            if not pending:
+                break
+            yield from pending.pop(0).result()
 
 if __name__ == "__main__":
     bits = 512  # number of bits for prime generation
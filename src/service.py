@@ -0,0 +1,280 @@
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import time
+from jobs import solve_job
+from result_cache import ResultCache, DEFAULT_CACHE_PATH
+
+
+# Protocol: one JSON object per line in both directions.
+#   {"op": "submit", "id": "job-1", "engine": "branch_prune", "N": ..., "known_bits_p": [...], "known_bits_q": [...],
+#    "priority": 0, "budget": 60}
+#   {"op": "submit", "engine": "crt_pruning", "N": ..., "e": 17, "known_bits_dp": "1?0?...", "known_bits_dq": "..."}
+#   {"op": "cancel", "id": "job-1"}
+#   {"op": "status"}
+# Events sent back for a job: queued, started, progress (every PROGRESS_INTERVAL seconds),
+# then one of result, cancelled, timeout or error. Lower priorities run first.
+# Jobs are solved by jobs.solve_job, like the jobs of main.py --job and --serve-stdin.
+
+PROGRESS_INTERVAL = 1.0
+
+
+def worker_main(connection, cache_path=None):
+    """
+    Loop of a worker process: receive job requests, send back ("ok", result) or ("error", message).
+    Each worker opens its own connection to the result cache at cache_path, if given.
+    """
+    cache = None if cache_path is None else ResultCache(cache_path)
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        try:
+            connection.send(("ok", solve_job(request, cache)))
+        except Exception as error:
+            connection.send(("error", f"{type(error).__name__}: {error}"))
+    if cache is not None:
+        cache.close()
+
+
+class Worker:
+    """
+    A warm worker process. Running jobs are cancelled by terminating the process, which is
+    then replaced by a fresh one.
+    """
+
+    def __init__(self, context, cache_path=None):
+        self.context = context
+        self.cache_path = cache_path
+        self.start()
+
+    def start(self):
+        self.connection, child_connection = self.context.Pipe()
+        self.process = self.context.Process(target=worker_main, args=(child_connection, self.cache_path), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def restart(self):
+        # The old connection is closed by run once the executor thread reading it gets EOFError
+        self.process.terminate()
+        self.process.join()
+        self.start()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+        self.connection.close()
+
+    def release(self, connection, receive):
+        if not receive.cancelled():
+            receive.exception()  # Retrieved here when the job timed out and nobody awaits it anymore
+        if connection is not self.connection:
+            connection.close()
+
+    async def run(self, request):
+        loop = asyncio.get_running_loop()
+        connection = self.connection
+        connection.send(request)
+        receive = loop.run_in_executor(None, connection.recv)
+        # Closing the connection while the executor thread reads it is unsafe, so the read is
+        # shielded from timeouts and the connection is released when the read returns, which
+        # after a restart is as soon as the old process is gone
+        receive.add_done_callback(lambda _: self.release(connection, receive))
+        return await asyncio.shield(receive)
+
+
+class Job:
+    def __init__(self, job_id, request, subscriber):
+        self.id = job_id
+        self.request = request
+        self.priority = request.get("priority", 0)
+        self.budget = request.get("budget")
+        self.subscribers = [subscriber]
+        self.state = "queued"
+        self.worker = None
+
+
+class RecoveryService:
+    def __init__(self, workers=None, cache_path=None):
+        # Forking inside the running event loop would copy its state and the executor threads
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self.context = multiprocessing.get_context(start_method)
+        self.workers = [Worker(self.context, cache_path) for _ in range(workers or os.cpu_count() or 1)]
+        self.queue = asyncio.PriorityQueue()
+        self.jobs = {}
+        self.sequence = itertools.count()
+
+    async def notify(self, job, event, **fields):
+        message = (json.dumps({"id": job.id, "event": event, **fields}) + "\n").encode()
+        for writer in list(job.subscribers):
+            try:
+                writer.write(message)
+                await writer.drain()
+            except ConnectionError:
+                job.subscribers.remove(writer)
+
+    async def submit(self, request, writer):
+        job_id = str(request.get("id") or f"job-{next(self.sequence)}")
+        if job_id in self.jobs and self.jobs[job_id].state in ("queued", "running"):
+            writer.write((json.dumps({"id": job_id, "event": "error", "error": "duplicate job id"}) + "\n").encode())
+            return
+        job = Job(job_id, request, writer)
+        self.jobs[job_id] = job
+        await self.queue.put((job.priority, next(self.sequence), job))
+        await self.notify(job, "queued", position=self.queue.qsize())
+
+    async def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.state not in ("queued", "running"):
+            return False
+        previous_state = job.state
+        job.state = "cancelled"
+        if previous_state == "running":
+            # The dispatcher waiting on this worker sees the pipe close and reports the cancellation
+            job.worker.restart()
+        else:
+            await self.notify(job, "cancelled")
+        return True
+
+    async def report_progress(self, job, start_time):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            await self.notify(job, "progress", elapsed=time.monotonic() - start_time)
+
+    def forget(self, job):
+        if self.jobs.get(job.id) is job:
+            del self.jobs[job.id]
+
+    async def dispatch(self, worker):
+        while True:
+            _, _, job = await self.queue.get()
+            if job.state != "queued":
+                self.forget(job)
+                continue
+            job.state = "running"
+            job.worker = worker
+            start_time = time.monotonic()
+            await self.notify(job, "started")
+            progress = asyncio.create_task(self.report_progress(job, start_time))
+            try:
+                status, value = await asyncio.wait_for(worker.run(job.request), job.budget)
+                job.state = "done"
+                if status == "ok":
+                    await self.notify(job, "result", result=value, elapsed=time.monotonic() - start_time)
+                else:
+                    await self.notify(job, "error", error=value)
+            except asyncio.TimeoutError:
+                job.state = "timeout"
+                worker.restart()
+                await self.notify(job, "timeout", elapsed=time.monotonic() - start_time)
+            except (EOFError, OSError):
+                if job.state != "cancelled":
+                    job.state = "error"
+                    worker.restart()
+                    await self.notify(job, "error", error="worker process died")
+                else:
+                    await self.notify(job, "cancelled")
+            finally:
+                progress.cancel()
+                job.worker = None
+                self.forget(job)
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    op = message.get("op")
+                except (ValueError, AttributeError):
+                    writer.write(b'{"event": "error", "error": "invalid JSON"}\n')
+                    continue
+                if op == "submit":
+                    await self.submit(message, writer)
+                elif op == "cancel":
+                    cancelled = await self.cancel(str(message.get("id")))
+                    if not cancelled:
+                        writer.write((json.dumps({"id": message.get("id"), "event": "error",
+                                                  "error": "no such queued or running job"}) + "\n").encode())
+                elif op == "status":
+                    running = [job.id for job in self.jobs.values() if job.state == "running"]
+                    writer.write((json.dumps({"event": "status", "queued": self.queue.qsize(), "running": running,
+                                              "workers": len(self.workers)}) + "\n").encode())
+                else:
+                    writer.write((json.dumps({"event": "error", "error": f"unknown op: {op}"}) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for job in self.jobs.values():
+                if writer in job.subscribers:
+                    job.subscribers.remove(writer)
+            writer.close()
+
+    async def serve(self, socket_path=None, port=None):
+        dispatchers = [asyncio.create_task(self.dispatch(worker)) for worker in self.workers]
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle_client, path=socket_path)
+        else:
+            server = await asyncio.start_server(self.handle_client, host="127.0.0.1", port=port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for dispatcher in dispatchers:
+                dispatcher.cancel()
+            for worker in self.workers:
+                worker.stop()
+
+
+def submit(request, socket_path=None, port=None):
+    """
+    Submit a job to a running service and yield its events until the job ends.
+
+    :param request: Job request (see the protocol above, "op" may be omitted)
+    :param socket_path: Path of the UNIX socket of the service
+    :param port: Port of the service on localhost, if it is not listening on a UNIX socket
+    :return: Generator of event dictionaries
+    """
+    if socket_path is not None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(socket_path)
+    else:
+        connection = socket.create_connection(("127.0.0.1", port))
+    with connection, connection.makefile("rw") as stream:
+        stream.write(json.dumps({"op": "submit", **request}) + "\n")
+        stream.flush()
+        for line in stream:
+            event = json.loads(line)
+            yield event
+            if event["event"] in ("result", "cancelled", "timeout", "error"):
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local recovery service with a job queue and warm worker processes')
+    parser.add_argument('--socket', default=None, help='Path of the UNIX socket to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='Port on localhost, when --socket is not given')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the result cache')
+    parser.add_argument('--cache-path', default=DEFAULT_CACHE_PATH, help='Path of the SQLite result cache')
+    args = parser.parse_args()
+
+    service_socket = args.socket
+    if service_socket is not None and os.path.exists(service_socket):
+        os.unlink(service_socket)
+    try:
+        asyncio.run(RecoveryService(args.workers, None if args.no_cache else args.cache_path).serve(service_socket, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
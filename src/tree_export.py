@@ -0,0 +1,73 @@
+import json
+import random
+
+
+class TreeExporter:
+    """
+    Stream the explored search tree to a file while the search runs.
+
+    Each node is written as soon as it is created, with only its id, its parent's id, its
+    level and the bits chosen at that level, either as JSON lines or as Graphviz DOT edges.
+    Pass the exporter to branch_and_prune / branch_and_prune_crt:
+
+        with TreeExporter("tree.jsonl", max_depth=20) as exporter:
+            branch_and_prune(N, known_bits_p, known_bits_q, exporter=exporter)
+
+    Nodes deeper than max_depth are skipped, and with sample_rate < 1 whole subtrees are
+    dropped at random: the children of a dropped node are dropped too, so every exported
+    node has its parent in the file.
+    """
+
+    def __init__(self, path, fmt=None, max_depth=None, sample_rate=1.0, seed=0):
+        self.fmt = fmt or ("dot" if path.endswith(".dot") else "jsonl")
+        if self.fmt not in ("jsonl", "dot"):
+            raise ValueError(f"unknown tree export format: {self.fmt}")
+        self.file = open(path, "w")
+        self.max_depth = max_depth
+        self.sample_rate = sample_rate
+        self.random = random.Random(seed)
+        self.next_id = 0
+        self.exported = 0
+        if self.fmt == "dot":
+            self.file.write("digraph tree {\n")
+
+    def add(self, parent_id, level, bits):
+        """
+        Export a node.
+
+        :param parent_id: Id of the parent node, None for a root
+        :param level: Level (bit position) of the node
+        :param bits: Dictionary of the bits chosen for this node, e.g. {"p": 1, "q": 0}
+        :return: Id of the node, or None if the node was not exported
+        """
+        if level > 0 and parent_id is None:
+            return None
+        if self.max_depth is not None and level > self.max_depth:
+            return None
+        if level > 0 and self.sample_rate < 1.0 and self.random.random() >= self.sample_rate:
+            return None
+
+        node_id = self.next_id
+        self.next_id += 1
+        self.exported += 1
+        if self.fmt == "jsonl":
+            self.file.write(json.dumps({"id": node_id, "parent": parent_id, "level": level, "bits": bits}) + "\n")
+        else:
+            label = ",".join(f"{name}={bit}" for name, bit in bits.items())
+            self.file.write(f'  n{node_id} [label="{level}: {label}"];\n')
+            if parent_id is not None:
+                self.file.write(f"  n{parent_id} -> n{node_id};\n")
+        return node_id
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.fmt == "dot":
+            self.file.write("}\n")
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()